@@ -1,4 +1,7 @@
+from functools import wraps
+
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseForbidden
 
 
 def login_exempt(view):
@@ -6,6 +9,17 @@ def login_exempt(view):
     return view
 
 
+def staff_required(view):
+    # Students have logins too (issue_credentials), so the views changing data in bulk
+    # are for the staff only
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
 class LoginRequiredMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -176,5 +176,35 @@ LOGGING = {
     },
 }
 
+# The cache is shared by all server processes: the landing page counters are invalidated
+# and the task progress is polled through it. The database cache needs no extra service
+# (its table is made by createcachetable), CACHE_BACKEND and CACHE_LOCATION select another,
+# e.g. django.core.cache.backends.redis.RedisCache and redis://redis:6379
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'main_app_cache'),
+    }
+}
+
+# Landing page counters are cached and invalidated on writes; the TTL is a safety net
+# for bulk operations that bypass model signals
+DASHBOARD_STATS_TTL = 300
+DASHBOARD_STATS_CONSOLIDATED = True
+
+# Worker processes used to score pairs in the similar objects search
+SIMILARITY_WORKERS = os.cpu_count() or 1
+
+# Worker processes used to parse the uploaded workbooks of one import
+IMPORT_WORKERS = os.cpu_count() or 1
+
+# Worker processes used to hash the passwords given out by issue_credentials
+PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+
+# The similar objects index keeps this many best pairs after a full build, incremental
+# updates add pairs scoring at least SIMILARITY_MIN_SCORE
+SIMILARITY_INDEX_LIMIT = 1000
+SIMILARITY_MIN_SCORE = 80
+
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
@@ -1,38 +1,59 @@
 from django.contrib import admin
 
 from .models import *
+from .util.similarity_index import update_similarity_index_for_model, similarity_dependents_of_deletion
+
+
+class SimilarityIndexedAdmin(admin.ModelAdmin):
+    # Keeps the similar objects index in sync with the edits made in the admin
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        update_similarity_index_for_model(type(obj), [obj.pk])
+
+    def delete_model(self, request, obj):
+        pk = obj.pk
+        dependents = similarity_dependents_of_deletion(type(obj).objects.filter(pk=pk))
+        super().delete_model(request, obj)
+        update_similarity_index_for_model(type(obj), [pk], dependents)
+
+    def delete_queryset(self, request, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+        dependents = similarity_dependents_of_deletion(queryset)
+        super().delete_queryset(request, queryset)
+        update_similarity_index_for_model(queryset.model, ids, dependents)
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(SimilarityIndexedAdmin):
     list_display = ['username', 'first_name', 'middle_name', 'last_name']
     # list_filter = ('first_name',)
     search_fields = ['username', 'first_name', 'middle_name', 'last_name']
 
 
 @admin.register(Location)
-class LocationAdmin(admin.ModelAdmin):
+class LocationAdmin(SimilarityIndexedAdmin):
     list_display = ['name']
     # list_filter = ('first_name',)
     search_fields = ['name']
 
 
 @admin.register(Department)
-class DepartmentAdmin(admin.ModelAdmin):
+class DepartmentAdmin(SimilarityIndexedAdmin):
     list_display = ['name']
     # list_filter = ('first_name',)
     search_fields = ['name']
 
 
 @admin.register(Subject)
-class SubjectAdmin(admin.ModelAdmin):
+class SubjectAdmin(SimilarityIndexedAdmin):
     list_display = ['name']
     # list_filter = ('first_name',)
     search_fields = ['name']
 
 
 @admin.register(Education)
-class EducationAdmin(admin.ModelAdmin):
+class EducationAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['student', 'department']
     list_display = ['student', 'department', 'start_date', 'finish_date']
     list_filter = ('department', 'start_date', 'finish_date')
@@ -48,7 +69,7 @@ class EducationAdmin(admin.ModelAdmin):
 
 
 @admin.register(Course)
-class CourseAdmin(admin.ModelAdmin):
+class CourseAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['location', 'subject']
     list_display = ['name', 'chapter', 'location', 'subject']
     list_filter = ('location', 'subject')
@@ -65,7 +86,7 @@ class CourseAdmin(admin.ModelAdmin):
 
 
 @admin.register(Seminar)
-class SeminarAdmin(admin.ModelAdmin):
+class SeminarAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['location', 'subject']
     list_display = ['name', 'location', 'subject']
     list_filter = ('location', 'subject')
@@ -73,7 +94,7 @@ class SeminarAdmin(admin.ModelAdmin):
 
 
 @admin.register(Project)
-class ProjectAdmin(admin.ModelAdmin):
+class ProjectAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['location', 'subject']
     list_display = ['name', 'location', 'subject']
     list_filter = ('location', 'subject')
@@ -81,7 +102,7 @@ class ProjectAdmin(admin.ModelAdmin):
 
 
 @admin.register(Olympiad)
-class OlympiadAdmin(admin.ModelAdmin):
+class OlympiadAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['location']
     list_display = ['name', 'stage', 'location']
     list_filter = ('location', 'stage')
@@ -89,7 +110,7 @@ class OlympiadAdmin(admin.ModelAdmin):
 
 
 @admin.register(CourseParticipation)
-class CourseParticipationAdmin(admin.ModelAdmin):
+class CourseParticipationAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['student', 'course', 'teacher']
     list_display = ['student', 'started', 'finished', 'course', 'teacher', 'mark']
     list_filter = ('started', 'finished', 'course', 'mark')
@@ -105,7 +126,7 @@ class CourseParticipationAdmin(admin.ModelAdmin):
 
 
 @admin.register(SeminarParticipation)
-class SeminarParticipationAdmin(admin.ModelAdmin):
+class SeminarParticipationAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['student', 'seminar', 'teacher']
     list_display = ['student', 'started', 'finished', 'seminar', 'teacher', 'mark']
     list_filter = ('started', 'finished', 'seminar', 'mark')
@@ -121,7 +142,7 @@ class SeminarParticipationAdmin(admin.ModelAdmin):
 
 
 @admin.register(ProjectParticipation)
-class ProjectParticipationAdmin(admin.ModelAdmin):
+class ProjectParticipationAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['student', 'project', 'curator']
     list_display = ['student', 'started', 'finished', 'project', 'curator']
     list_filter = ('started', 'finished', 'curator')
@@ -137,7 +158,7 @@ class ProjectParticipationAdmin(admin.ModelAdmin):
 
 
 @admin.register(OlympiadParticipation)
-class OlympiadParticipationAdmin(admin.ModelAdmin):
+class OlympiadParticipationAdmin(SimilarityIndexedAdmin):
     autocomplete_fields = ['student', 'olympiad']
     list_display = ['student', 'started', 'finished', 'olympiad']
     list_filter = ('started', 'finished', 'olympiad')
@@ -0,0 +1,143 @@
+import os
+import pathlib
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Iterator
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...util.bulk_import import BulkImporter, file_digest, imported_file_digests, record_imported_files
+from ...util.dashboard import invalidate_dashboard_stats
+from ...util.data_import import find_files, parse_file, route_records, csv_data
+from ...util.dedupe import dedupe_educations
+from ...util.util import process_pool, chunks
+
+
+def parse_path(path: str, name: str, use_old_format: bool) -> dict[str, csv_data]:
+    # Workers read the files themselves, so the contents do not travel between processes
+    return parse_file(pathlib.Path(path).read_bytes(), name, use_old_format)
+
+
+def count_rows(data: dict[str, csv_data]) -> int:
+    return sum(len(v) for v in data.values())
+
+
+class Command(BaseCommand):
+    help = 'Imports all ODS files under a directory. Files are parsed in parallel and imported in chunks, ' \
+           'each in its own transaction; imported files are recorded, so an interrupted run resumes ' \
+           'with the files not imported yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', help='Directory to search for .ods files')
+        parser.add_argument('--old-format', action='store_true', help='Parse the files in the old format')
+        parser.add_argument('--workers', type=int, default=settings.IMPORT_WORKERS,
+                            help='Processes used for parsing')
+        parser.add_argument('--chunk-files', type=int, default=50,
+                            help='Files imported in one transaction')
+        parser.add_argument('--force', action='store_true',
+                            help='Import the files and rows imported before again')
+
+    def handle(self, *args, **options):
+        root = options['root']
+        if not os.path.isdir(root):
+            raise CommandError(f'Not a directory: {root}')
+        if options['chunk_files'] < 1:
+            raise CommandError('--chunk-files must be positive')
+
+        use_old_format = options['old_format']
+        files = []  # (path, name, digest)
+        for p in sorted(find_files(root)):
+            if p.suffix.lower() == '.ods':
+                files.append((str(p), str(p.relative_to(root)), file_digest(p.read_bytes(), use_old_format)))
+
+        total = len(files)
+        if not options['force']:
+            known = imported_file_digests(digest for _, _, digest in files)
+            files = [f for f in files if f[2] not in known]
+        self.stdout.write(f'Found {total} files, {total - len(files)} imported before, {len(files)} to import')
+        if not files:
+            return
+
+        started = time.perf_counter()
+        done = 0
+        rows = 0
+        skipped_rows = 0
+        created = Counter()
+        education_student_ids = set()
+        failed = []
+
+        with process_pool(max(1, options['workers'])) as pool:
+            file_chunks = list(chunks(files, options['chunk_files']))
+
+            def submit(chunk) -> deque[Future]:
+                return deque(pool.submit(parse_path, path, name, use_old_format) for path, name, _ in chunk)
+
+            # The next chunk is parsed while the current one is imported
+            futures = submit(file_chunks[0])
+            for i, chunk in enumerate(file_chunks):
+                current = futures
+                futures = submit(file_chunks[i + 1]) if i + 1 < len(file_chunks) else deque()
+                imported = []
+
+                def parsed_files() -> Iterator[dict[str, csv_data]]:
+                    nonlocal done
+                    for path, name, digest in chunk:
+                        done += 1
+                        try:
+                            # Popped, so a file's records are dropped once imported
+                            data = current.popleft().result()
+                        except Exception as e:
+                            # The file is not recorded, so the next run tries it again
+                            failed.append(name)
+                            self.stderr.write(f'[{done}/{len(files)}] {name}: {type(e).__name__}: {e}')
+                            continue
+                        imported.append((name, digest))
+                        self.stdout.write(f'[{done}/{len(files)}] {name}: {count_rows(data)} rows')
+                        yield data
+
+                chunk_started = time.perf_counter()
+                chunk_rows = 0
+                with transaction.atomic():
+                    importer = BulkImporter(strict=False, force=options['force'])
+                    for kind, rec in route_records(parsed_files()):
+                        importer.add(kind, rec)
+                        chunk_rows += 1
+                    result = importer.run()
+                    record_imported_files(imported)
+                if not imported:
+                    continue
+
+                rows += chunk_rows
+                skipped_rows += result.skipped_rows
+                created.update(result.created)
+                education_student_ids |= result.education_student_ids
+                seconds = time.perf_counter() - chunk_started
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'Imported {len(imported)} files, {chunk_rows} rows '
+                    f'({result.skipped_rows} known, {result.invalid_rows} invalid) '
+                    f'in {seconds:.1f}s, {chunk_rows / max(seconds, 1e-6):.0f} rows/s; '
+                    f'overall {rows / max(elapsed, 1e-6):.0f} rows/s'
+                )
+
+        if education_student_ids:
+            # Educations are stitched within a chunk, the ones of a student split between
+            # chunks (or imported before) are merged now, for the students of this run only
+            res = dedupe_educations(student_ids=education_student_ids)
+            self.stdout.write(f"Merged educations: {res['updated']} updated, {res['deleted']} deleted")
+
+        invalidate_dashboard_stats()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Done: {len(files) - len(failed)} files, {rows} rows ({skipped_rows} known) in {elapsed:.1f}s, '
+            f'{rows / max(elapsed, 1e-6):.0f} rows/s'
+        )
+        for model, n in created.items():
+            if n:
+                self.stdout.write(f'  {model.__name__}: {n} created')
+        if failed:
+            self.stderr.write(f'Failed to parse {len(failed)} files: {", ".join(failed)}')
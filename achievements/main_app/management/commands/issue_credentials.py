@@ -0,0 +1,59 @@
+import csv
+import sys
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, UNUSABLE_PASSWORD_PREFIX
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import User
+from ...util.data_import import generate_password
+from ...util.util import process_pool
+
+HASH_CHUNK_SIZE = 64
+
+
+class Command(BaseCommand):
+    help = 'Generates passwords for accounts which need to log in (imported accounts have unusable ones) ' \
+           'and writes them as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Accounts to issue passwords for')
+        parser.add_argument('--unusable', action='store_true',
+                            help='Issue passwords for all accounts without a usable one')
+        parser.add_argument('--output', help='CSV file for the credentials (default: stdout)')
+        parser.add_argument('--workers', type=int, default=settings.PASSWORD_HASH_WORKERS,
+                            help='Processes used for hashing')
+
+    def handle(self, *args, **options):
+        if not options['usernames'] and not options['unusable']:
+            raise CommandError('Give some usernames or --unusable')
+
+        users = User.objects.order_by('username')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        if options['unusable']:
+            users = users.filter(password__startswith=UNUSABLE_PASSWORD_PREFIX)
+        users = list(users)
+
+        passwords = [generate_password() for _ in users]
+        if options['workers'] > 1 and len(users) > HASH_CHUNK_SIZE:
+            with process_pool(options['workers']) as pool:
+                hashes = list(pool.map(make_password, passwords, chunksize=HASH_CHUNK_SIZE))
+        else:
+            hashes = [make_password(p) for p in passwords]
+
+        for u, h in zip(users, hashes):
+            u.password = h
+        User.objects.bulk_update(users, ['password'], batch_size=1000)
+
+        f = open(options['output'], 'w', newline='', encoding='utf8') if options['output'] else sys.stdout
+        try:
+            w = csv.writer(f)
+            w.writerow(['username', 'full_name', 'password'])
+            for u, p in zip(users, passwords):
+                w.writerow([u.username, u.full_name(), p])
+        finally:
+            if f is not sys.stdout:
+                f.close()
+
+        self.stderr.write(f'Issued passwords for {len(users)} accounts')
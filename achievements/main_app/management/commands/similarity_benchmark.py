@@ -0,0 +1,82 @@
+import time
+from typing import Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...util.similarity import obj_type_projection_map, fetch_projected_strings, similarity_recall, cmp_func_map, \
+    RERANK_FACTOR
+
+
+def find_nearest_strings_legacy(
+        limit: int,
+        objects: list[str],
+        method: str
+) -> list[Tuple[int, str, str]]:
+    # The original all-pairs implementation with a sorted list, kept as a baseline
+    l = len(objects)
+    result = []
+    cmp_func = cmp_func_map[method]
+
+    for obj_ix1 in range(l):
+        for obj_ix2 in range(obj_ix1 + 1, l):
+            ratio = cmp_func(
+                objects[obj_ix1],
+                objects[obj_ix2]
+            )
+            x = (ratio, objects[obj_ix1], objects[obj_ix2])
+
+            if len(result) == 0:
+                result.append(x)
+                continue
+            if len(result) > limit and result[-1][0] >= ratio:
+                continue
+            for i, (ratio_, object1, object2) in enumerate(result):
+                if ratio > ratio_:
+                    result.insert(i, x)
+                    if len(result) > limit:
+                        result.pop()
+                    break
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Compares the blocked similarity search with the exhaustive one (recall and timing)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('obj_types', nargs='*', default=['user', 'course', 'olympiad'],
+                            help='Object types, e.g. user course olympiad')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--method', default='ratio', choices=list(cmp_func_map))
+        parser.add_argument('--max-objects', type=int, default=0, help='Only use the first N objects (0 = all)')
+        parser.add_argument('--rerank-factor', type=int, default=RERANK_FACTOR,
+                            help='Survivors of the ratio prefilter per result (0 = score all candidates with the method)')
+        parser.add_argument('--legacy', action='store_true', help='Also time the original list-based implementation')
+
+    def handle(self, *args, **options):
+        for obj_type in options['obj_types']:
+            if obj_type not in obj_type_projection_map:
+                raise CommandError(f'Bad object type: {obj_type}')
+
+            strings = [s for _, s in fetch_projected_strings(obj_type)]
+            if options['max_objects'] > 0:
+                strings = strings[:options['max_objects']]
+
+            res = similarity_recall(
+                options['limit'],
+                strings,
+                options['method'],
+                options['rerank_factor']
+            )
+
+            self.stdout.write(
+                f"{obj_type}: {res['objects']} objects, "
+                f"exhaustive {res['exhaustive_seconds']:.2f}s, "
+                f"blocked {res['blocked_seconds']:.2f}s, "
+                f"pair recall {res['pair_recall']:.2%}, "
+                f"score recall {res['score_recall']:.2%}"
+            )
+
+            if options['legacy']:
+                t0 = time.perf_counter()
+                find_nearest_strings_legacy(options['limit'], strings, options['method'])
+                self.stdout.write(f"{obj_type}: legacy {time.perf_counter() - t0:.2f}s")
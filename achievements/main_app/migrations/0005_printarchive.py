@@ -0,0 +1,33 @@
+# Generated by Django 4.0.4 on 2026-10-19 19:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0004_user_gender'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrintArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(verbose_name='Год выпуска')),
+                ('format', models.CharField(max_length=16, verbose_name='Формат')),
+                ('students_count', models.IntegerField(verbose_name='Количество учащихся')),
+                ('generated', models.DateTimeField(auto_now=True, verbose_name='Дата формирования')),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.department', verbose_name='Площадка')),
+            ],
+            options={
+                'verbose_name': 'архив зачетных книжек',
+                'verbose_name_plural': 'архивы зачетных книжек',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='printarchive',
+            constraint=models.UniqueConstraint(fields=('department', 'year', 'format'), name='unique_print_archive'),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 4.0.4 on 2026-10-19 20:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0005_printarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(verbose_name='Похожесть')),
+                ('dismissed', models.BooleanField(default=False, verbose_name='Не дубликат')),
+            ],
+            options={
+                'verbose_name': 'возможный дубликат',
+                'verbose_name_plural': 'возможные дубликаты',
+            },
+        ),
+        migrations.CreateModel(
+            name='SimilarityEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('obj_type', models.CharField(max_length=32, verbose_name='Тип объекта')),
+                ('object_id', models.BigIntegerField(verbose_name='ID объекта')),
+                ('string', models.TextField(verbose_name='Текстовое представление')),
+            ],
+            options={
+                'verbose_name': 'индексированный объект',
+                'verbose_name_plural': 'индексированные объекты',
+            },
+        ),
+        migrations.CreateModel(
+            name='SimilarityIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('obj_type', models.CharField(max_length=32, verbose_name='Тип объектов')),
+                ('method', models.CharField(max_length=32, verbose_name='Метод сравнения')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'индекс похожих объектов',
+                'verbose_name_plural': 'индексы похожих объектов',
+            },
+        ),
+        migrations.CreateModel(
+            name='SimilarityKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('obj_type', models.CharField(max_length=32, verbose_name='Тип объекта')),
+                ('key', models.CharField(max_length=255, verbose_name='Ключ')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.similarityentry', verbose_name='Объект')),
+            ],
+            options={
+                'verbose_name': 'ключ блокировки',
+                'verbose_name_plural': 'ключи блокировки',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarityindex',
+            constraint=models.UniqueConstraint(fields=('obj_type', 'method'), name='unique_similarity_index'),
+        ),
+        migrations.AddConstraint(
+            model_name='similarityentry',
+            constraint=models.UniqueConstraint(fields=('obj_type', 'object_id'), name='unique_similarity_entry'),
+        ),
+        migrations.AddField(
+            model_name='similaritycandidate',
+            name='entry1',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main_app.similarityentry', verbose_name='Объект 1'),
+        ),
+        migrations.AddField(
+            model_name='similaritycandidate',
+            name='entry2',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main_app.similarityentry', verbose_name='Объект 2'),
+        ),
+        migrations.AddField(
+            model_name='similaritycandidate',
+            name='index',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.similarityindex', verbose_name='Индекс'),
+        ),
+        migrations.AddIndex(
+            model_name='similaritykey',
+            index=models.Index(fields=['obj_type', 'key'], name='similarity_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='similaritycandidate',
+            index=models.Index(fields=['index', 'dismissed', '-score'], name='similarity_candidate_top_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='similaritycandidate',
+            constraint=models.UniqueConstraint(fields=('index', 'entry1', 'entry2'), name='unique_similarity_candidate'),
+        ),
+    ]
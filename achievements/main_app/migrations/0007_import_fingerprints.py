@@ -0,0 +1,39 @@
+# Generated by Django 4.0.4 on 2026-10-19 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0006_similarity_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='Хеш содержимого')),
+                ('imported', models.DateTimeField(auto_now=True, verbose_name='Дата импорта')),
+            ],
+            options={
+                'verbose_name': 'импортированный файл',
+                'verbose_name_plural': 'импортированные файлы',
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64, unique=True, verbose_name='Отпечаток строки')),
+                ('kind', models.CharField(max_length=32, verbose_name='Тип записи')),
+                ('object_id', models.BigIntegerField(verbose_name='ID объекта')),
+            ],
+            options={
+                'verbose_name': 'отпечаток импортированной строки',
+                'verbose_name_plural': 'отпечатки импортированных строк',
+            },
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 4.0.4 on 2026-10-19 20:35
+
+import hashlib
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+education_fields = ['student_id', 'department_id', 'start_date', 'start_class', 'finish_date', 'finish_class']
+
+# Frozen copies of main_app.util.natural_keys as of this migration, so later changes of
+# the helpers do not change what it does
+participation_natural_key_fields = {
+    'CourseParticipation': ['student_id', 'course_id', 'started', 'finished', 'hours', 'teacher_id', 'mark', 'is_exam'],
+    'SeminarParticipation': ['student_id', 'seminar_id', 'started', 'finished', 'hours', 'teacher_id', 'mark'],
+    'ProjectParticipation': ['student_id', 'project_id', 'started', 'finished', 'curator_id'],
+    'OlympiadParticipation': ['student_id', 'olympiad_id', 'started', 'finished', 'title', 'prize', 'is_team_member'],
+}
+
+
+def natural_key_digest(model_name, values):
+    return hashlib.sha256(repr((model_name, tuple(values))).encode()).hexdigest()
+
+
+def delete_in_batches(model, ids):
+    for i in range(0, len(ids), BATCH_SIZE):
+        model._base_manager.filter(pk__in=ids[i:i + BATCH_SIZE]).delete()
+
+
+def forget_similarity_entries(apps, obj_types, ids):
+    SimilarityEntry = apps.get_model('main_app', 'SimilarityEntry')
+    for i in range(0, len(ids), BATCH_SIZE):
+        SimilarityEntry.objects.filter(obj_type__in=obj_types, object_id__in=ids[i:i + BATCH_SIZE]).delete()
+
+
+def dedupe_and_fill_keys(apps, schema_editor):
+    # Duplicates are deleted before the constraints are created, the oldest row is kept
+    Education = apps.get_model('main_app', 'Education')
+    seen = set()
+    duplicates = []
+    for pk, *key in Education.objects.order_by('pk').values_list('pk', *education_fields).iterator():
+        key = tuple(key)
+        if key in seen:
+            duplicates.append(pk)
+        else:
+            seen.add(key)
+    delete_in_batches(Education, duplicates)
+    forget_similarity_entries(apps, ['education'], duplicates)
+
+    Participation = apps.get_model('main_app', 'Participation')
+    for name, fields in participation_natural_key_fields.items():
+        model = apps.get_model('main_app', name)
+        seen = set()
+        duplicates = []
+        keys = []
+        for pk, *values in model.objects.order_by('pk').values_list('pk', *fields).iterator():
+            natural_key = natural_key_digest(name, values)
+            if natural_key in seen:
+                duplicates.append(pk)
+            else:
+                seen.add(natural_key)
+                keys.append(Participation(pk=pk, natural_key=natural_key))
+        delete_in_batches(model, duplicates)
+        forget_similarity_entries(apps, ['participation', 'award', name.lower()], duplicates)
+        Participation.objects.bulk_update(keys, ['natural_key'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0007_import_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participation',
+            name='natural_key',
+            field=models.CharField(editable=False, max_length=64, null=True, verbose_name='Естественный ключ'),
+        ),
+        migrations.RunPython(dedupe_and_fill_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='participation',
+            name='natural_key',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True, verbose_name='Естественный ключ'),
+        ),
+        migrations.AddConstraint(
+            model_name='education',
+            constraint=models.UniqueConstraint(fields=('student', 'department', 'start_date', 'start_class', 'finish_date', 'finish_class'), name='unique_education'),
+        ),
+    ]
@@ -1,11 +1,14 @@
 from typing import Any
 
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import F, TextChoices
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from .util.natural_keys import compute_natural_key
+
 
 def adv_join(sep: Any, objs: list[Any]) -> str:
     sep_s = str(sep)
@@ -113,6 +116,12 @@ class Education(models.Model):
     class Meta:
         verbose_name = "обучение"
         verbose_name_plural = "обучения"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['student', 'department', 'start_date', 'start_class', 'finish_date', 'finish_class'],
+                name='unique_education'
+            )
+        ]
 
 
 class Subject(models.Model):
@@ -206,10 +215,24 @@ class Participation(models.Model):
     student = models.ForeignKey(User, verbose_name="Учащийся", on_delete=models.CASCADE)
     started = models.DateTimeField("Начало участия", null=True)
     finished = models.DateTimeField("Конец участия")
+    # Digest of the fields identifying the participation, see util/natural_keys.py
+    natural_key = models.CharField("Естественный ключ", max_length=64, unique=True, null=True, editable=False)
 
     def __str__(self):
         return f"{self.student} ({self.started} - {self.finished})"
 
+    def clean(self):
+        super().clean()
+        natural_key = compute_natural_key(self)
+        if natural_key and Participation.objects.filter(natural_key=natural_key).exclude(pk=self.pk).exists():
+            raise ValidationError('Такое участие уже существует')
+
+    def save(self, *args, **kwargs):
+        self.natural_key = compute_natural_key(self)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'natural_key'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "участие"
         verbose_name_plural = "участия"
@@ -267,11 +290,122 @@ class OlympiadParticipation(Participation, Award):
         verbose_name_plural = "участия в олимпиадах"
 
 
+class PrintArchive(models.Model):
+    department = models.ForeignKey(Department, verbose_name="Площадка", on_delete=models.CASCADE)
+    year = models.IntegerField("Год выпуска")
+    format = models.CharField("Формат", max_length=16)
+    students_count = models.IntegerField("Количество учащихся")
+    generated = models.DateTimeField("Дата формирования", auto_now=True)
+
+    def __str__(self):
+        return f"{self.department}, {self.year} ({self.format})"
+
+    class Meta:
+        verbose_name = "архив зачетных книжек"
+        verbose_name_plural = "архивы зачетных книжек"
+        constraints = [
+            models.UniqueConstraint(fields=['department', 'year', 'format'], name='unique_print_archive')
+        ]
+
+
+class SimilarityIndex(models.Model):
+    obj_type = models.CharField("Тип объектов", max_length=32)
+    method = models.CharField("Метод сравнения", max_length=32)
+    updated = models.DateTimeField("Дата обновления", auto_now=True)
+
+    def __str__(self):
+        return f"{self.obj_type}, {self.method}"
+
+    class Meta:
+        verbose_name = "индекс похожих объектов"
+        verbose_name_plural = "индексы похожих объектов"
+        constraints = [
+            models.UniqueConstraint(fields=['obj_type', 'method'], name='unique_similarity_index')
+        ]
+
+
+class SimilarityEntry(models.Model):
+    obj_type = models.CharField("Тип объекта", max_length=32)
+    object_id = models.BigIntegerField("ID объекта")
+    string = models.TextField("Текстовое представление")
+
+    def __str__(self):
+        return self.string
+
+    class Meta:
+        verbose_name = "индексированный объект"
+        verbose_name_plural = "индексированные объекты"
+        constraints = [
+            models.UniqueConstraint(fields=['obj_type', 'object_id'], name='unique_similarity_entry')
+        ]
+
+
+class SimilarityKey(models.Model):
+    obj_type = models.CharField("Тип объекта", max_length=32)
+    key = models.CharField("Ключ", max_length=255)
+    entry = models.ForeignKey(SimilarityEntry, verbose_name="Объект", on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = "ключ блокировки"
+        verbose_name_plural = "ключи блокировки"
+        indexes = [
+            models.Index(fields=['obj_type', 'key'], name='similarity_key_idx')
+        ]
+
+
+class SimilarityCandidate(models.Model):
+    index = models.ForeignKey(SimilarityIndex, verbose_name="Индекс", on_delete=models.CASCADE)
+    entry1 = models.ForeignKey(SimilarityEntry, verbose_name="Объект 1", related_name='+', on_delete=models.CASCADE)
+    entry2 = models.ForeignKey(SimilarityEntry, verbose_name="Объект 2", related_name='+', on_delete=models.CASCADE)
+    score = models.IntegerField("Похожесть")
+    dismissed = models.BooleanField("Не дубликат", default=False)
+
+    def __str__(self):
+        return f"{self.entry1} ~ {self.entry2} ({self.score})"
+
+    class Meta:
+        verbose_name = "возможный дубликат"
+        verbose_name_plural = "возможные дубликаты"
+        constraints = [
+            models.UniqueConstraint(fields=['index', 'entry1', 'entry2'], name='unique_similarity_candidate')
+        ]
+        indexes = [
+            models.Index(fields=['index', 'dismissed', '-score'], name='similarity_candidate_top_idx')
+        ]
+
+
+class ImportedFile(models.Model):
+    name = models.CharField("Имя файла", max_length=255)
+    digest = models.CharField("Хеш содержимого", max_length=64, unique=True)
+    imported = models.DateTimeField("Дата импорта", auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.imported})"
+
+    class Meta:
+        verbose_name = "импортированный файл"
+        verbose_name_plural = "импортированные файлы"
+
+
+class ImportFingerprint(models.Model):
+    fingerprint = models.CharField("Отпечаток строки", max_length=64, unique=True)
+    kind = models.CharField("Тип записи", max_length=32)
+    object_id = models.BigIntegerField("ID объекта")
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.fingerprint}"
+
+    class Meta:
+        verbose_name = "отпечаток импортированной строки"
+        verbose_name_plural = "отпечатки импортированных строк"
+
+
 def wipe_all(keep_admin=True):
     users = User.objects.all()
     if keep_admin:
         users = users.exclude(username='admin')
     users.delete()
 
-    for c in [Location, Department, Course, Olympiad, Project, Seminar, Subject]:
+    for c in [Location, Department, Course, Olympiad, Project, Seminar, Subject, ImportedFile, ImportFingerprint,
+              SimilarityCandidate, SimilarityKey, SimilarityEntry, SimilarityIndex]:
         c.objects.all().delete()
\ No newline at end of file
@@ -0,0 +1,27 @@
+function bulk_edit(preview) {
+    let form = $('#bulk_edit_form');
+    let values = {};
+    form.find('.bulk-edit-change:checked').each(function() {
+        let f = $(this).data('field');
+        values[f] = $(`#value_${f}`).val();
+    });
+
+    $.ajax({
+    url: '/tasks/edit/bulk',
+    method: 'POST',
+    data: {
+        csrfmiddlewaretoken: form.find('[name=csrfmiddlewaretoken]').val(),
+        object_type: form.find('[name=object_type]').val(),
+        filter: $('#bulk_edit_filter').val(),
+        values: JSON.stringify(values),
+        preview: preview ? 1 : '',
+    },
+    })
+    .done (function(data, textStatus, jqXHR) {
+          let text = data.preview ? `Будет изменено записей: ${data.count}` : `Изменено записей: ${data.count}`;
+          $('#bulk_edit_msg').removeClass('alert-danger').addClass('alert-success').removeClass('d-none').text(text);
+    })
+    .fail (function(jqXHR, textStatus, errorThrown) {
+          $('#bulk_edit_msg').removeClass('alert-success').addClass('alert-danger').removeClass('d-none').text(jqXHR.responseText);
+    });
+}
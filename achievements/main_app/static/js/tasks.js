@@ -1,10 +1,10 @@
-function dedupe_edu() {
+function dedupe_edu(dry_run) {
     $('#dedupe_edu_spinner').removeClass('d-none')
     $.ajax({
-    url: "/tasks/dedupe_edu",
+    url: dry_run ? "/tasks/dedupe_edu?dry_run=1" : "/tasks/dedupe_edu",
     })
     .done (function(data, textStatus, jqXHR) {
-          $('#dedupe_edu_msg').addClass('alert-success').removeClass('d-none').text(data);
+          $('#dedupe_edu_msg').removeClass('alert-danger').addClass('alert-success').removeClass('d-none').text(data);
     })
     .fail (function(jqXHR, textStatus, errorThrown) {
           $('#dedupe_edu_msg').addClass('alert-danger').removeClass('d-none').text(jqXHR.responseText);
@@ -14,10 +14,11 @@ function dedupe_edu() {
     });
 }
 
-function check_names() {
+function check_names(page) {
     $('#check_names_spinner').removeClass('d-none')
     $.ajax({
     url: "/tasks/check_names",
+    data: {page: page || 1},
     })
     .done (function(data, textStatus, jqXHR) {
           $('#modal_dialog .modal-title').html('Результаты');
@@ -32,13 +33,59 @@ function check_names() {
     });
 }
 
+function get_cookie(name) {
+    let m = document.cookie.match(new RegExp(`(^|;\\s*)${name}=([^;]*)`));
+    return m ? decodeURIComponent(m[2]) : null;
+}
+
+function dismiss_similar(id, btn) {
+    $.ajax({
+    url: `/tasks/similar_objects/${id}/dismiss`,
+    method: 'POST',
+    headers: {'X-CSRFToken': get_cookie('csrftoken')},
+    })
+    .done (function(data, textStatus, jqXHR) {
+          $(btn).closest('tr').remove();
+    });
+}
+
+function merge_similar(obj_type, survivor_id, victim_id, btn) {
+    $.ajax({
+    url: '/tasks/edit/merge',
+    method: 'POST',
+    headers: {'X-CSRFToken': get_cookie('csrftoken')},
+    data: {object_type: obj_type, survivor_id: survivor_id, object_ids: victim_id},
+    })
+    .done (function(data, textStatus, jqXHR) {
+          $(btn).closest('tr').remove();
+    })
+    .fail (function(jqXHR, textStatus, errorThrown) {
+          alert(jqXHR.responseText);
+    });
+}
+
+function poll_task_progress(task_id, bar) {
+    return setInterval(function() {
+        $.getJSON(`/tasks/progress/${task_id}`, function(p) {
+            if (p.total) {
+                let pct = Math.round(100 * p.done / p.total);
+                bar.removeClass('d-none');
+                bar.find('.progress-bar').css('width', `${pct}%`).text(`${pct}%`);
+            }
+        });
+    }, 1000);
+}
+
 function find_similar() {
     let t = $("#find_similar_obj_type").val()
     let l = $("#find_similar_limit").val()
     let m = $("#find_similar_method").val()
+    let task_id = Math.random().toString(36).substring(2);
+    let bar = $('#find_similar_progress');
+    let poll = poll_task_progress(task_id, bar);
     $('#find_similar_spinner').removeClass('d-none')
     $.ajax({
-    url: `/tasks/find_similar_objects/${t}/${m}/${l}`,
+    url: `/tasks/find_similar_objects/${t}/${m}/${l}?task=${task_id}`,
     })
     .done (function(data, textStatus, jqXHR) {
             // .addClass('alert-success')
@@ -51,6 +98,8 @@ function find_similar() {
           $('#find_similar_msg').addClass('alert-danger').removeClass('d-none').text(jqXHR.responseText);
     })
     .always(function() {
+        clearInterval(poll);
+        bar.addClass('d-none').find('.progress-bar').css('width', '0%').text('');
         $('#find_similar_spinner').addClass('d-none')
     });
 }
\ No newline at end of file
@@ -1,3 +1,392 @@
+import io
+import json
+import random
+from datetime import date, datetime
+
+from django.db import IntegrityError, transaction
 from django.test import TestCase
+from odf.opendocument import OpenDocumentSpreadsheet, load
+from odf.table import Table, TableRow, TableCell
+from odf.text import P
+
+from .models import *
+from .util.bulk_edit import bulk_edit, BulkEditException
+from .util.bulk_import import BulkImporter
+from .util.data_import import sheet_kinds, parse_file, route_records
+from .util.dedupe import dedupe_educations
+from .util.merge import merge_objects
+from .util.ods import OdsDocument, SparseRow
+from .util.similarity import top_pairs, all_pairs, candidate_pairs, find_nearest_strings, normalize_string, \
+    make_scorer
+
+
+def make_ods(sheets: dict[str, list[list[str]]], repeated_rows: dict[int, int] = None) -> bytes:
+    # Rows end with the ~1000 repeated empty cells LibreOffice writes
+    doc = OpenDocumentSpreadsheet()
+    for name, rows in sheets.items():
+        t = Table(name=name)
+        for i, row in enumerate(rows):
+            n = (repeated_rows or {}).get(i, 1)
+            tr = TableRow(numberrowsrepeated=n) if n > 1 else TableRow()
+            for v in row:
+                c = TableCell()
+                if v:
+                    c.addElement(P(text=v))
+                tr.addElement(c)
+            tr.addElement(TableCell(numbercolumnsrepeated=1000))
+            t.addElement(tr)
+        doc.spreadsheet.addElement(t)
+    b = io.BytesIO()
+    doc.write(b)
+    return b.getvalue()
+
+
+def records_to_sheets(data: dict[str, list[dict[str, str]]]) -> dict[str, list[list[str]]]:
+    sheets = {}
+    for kind, name in sheet_kinds.items():
+        recs = data.get(kind, [])
+        header = list(recs[0]) if recs else ['Фамилия']
+        sheets[name] = [header] + [[r[h] for h in header] for r in recs]
+    return sheets
+
+
+def person(last_name, first_name='Анна', middle_name='Петровна', prefix=''):
+    return {f'Фамилия{prefix}': last_name, f'Имя{prefix}': first_name, f'Отчество{prefix}': middle_name}
+
+
+def sample_data() -> dict[str, list[dict[str, str]]]:
+    teacher = person('Петров', 'Иван', 'Иванович', ' преподавателя')
+    data = {'education': [], 'course': [], 'seminar': [], 'project': [], 'olympiad': []}
+    for i in range(5):
+        student = person(f'Иванова{i}')
+        data['education'].append({
+            **student, 'Площадка': 'Математическая площадка', 'Дата поступления': '01.09.2015',
+            'Класс поступления': '7', 'Дата завершения': '30.05.2020', 'Класс завершения': '11',
+            'Контактный телефон': f'+7900000000{i}', 'Контактный email': '',
+        })
+        data['course'].append({
+            **student, 'Название': 'алгебра', 'Глава': '1', 'Предмет': 'математика', 'Количество часов': '10',
+            'Начало': '01.09.2019', 'Завершение': '30.05.2020', 'Место проведения': 'ЛНМО', 'Оценка/зачёт': '5',
+            **teacher, 'Экзамен': 'Нет',
+        })
+        data['seminar'].append({
+            **student, 'Название семинара': 'Семинар', 'Предмет': 'Математика', 'Количество часов': '3',
+            'Оценка/зачёт': '', 'Начало': '01.09.2019', 'Завершение': '30.05.2020', 'Место проведения': 'ЛНМО',
+            **teacher,
+        })
+        data['project'].append({
+            **student, 'Название проекта': 'Проект', 'Место проведения': 'ЛНМО', 'Предмет': 'Физика',
+            'Начало': '01.09.2019', 'Завершение': '30.05.2020', **person('Петров', 'Иван', 'Иванович', ' руководителя'),
+        })
+        data['olympiad'].append({
+            **student, 'Этап': 'Региональный', 'Название конкурса / олимпиады': 'Всеросс', 'Начало': '01.09.2019',
+            'Завершение': '30.05.2020', 'Место проведения': 'Москва', 'Звание': 'Призёр', 'Награда': '',
+            'В составе команды': 'Нет',
+        })
+    return data
+
+
+def import_ods(content: bytes, force=False):
+    importer = BulkImporter(strict=False, force=force)
+    for kind, rec in route_records([parse_file(content, 'test.ods')]):
+        importer.add(kind, rec)
+    return importer.run()
+
+
+counted_models = [User, Department, Subject, Location, Course, Seminar, Project, Olympiad, Education,
+                  CourseParticipation, SeminarParticipation, ProjectParticipation, OlympiadParticipation]
+
+
+def object_counts() -> dict[type, int]:
+    return {m: m.objects.count() for m in counted_models}
+
+
+class BulkImportTests(TestCase):
+    def test_import_twice_gives_same_objects(self):
+        content = make_ods(records_to_sheets(sample_data()))
+        result = import_ods(content)
+        counts = object_counts()
+        self.assertEqual(counts[User], 6)
+        self.assertEqual(counts[CourseParticipation], 5)
+        self.assertEqual(result.created[Education], 5)
+        self.assertEqual(User.objects.get(last_name='Иванова0').phone_number, '+79000000000')
+        self.assertEqual(Course.objects.get().name, 'Алгебра')
+
+        forced = import_ods(content, force=True)
+        self.assertEqual(object_counts(), counts)
+        self.assertFalse(any(forced.created.values()))
+        self.assertEqual(forced.existing[CourseParticipation], 5)
+
+    def test_invalid_rows_are_skipped(self):
+        data = sample_data()
+        data['course'][0]['Количество часов'] = 'abc'
+        data['seminar'][0]['Начало'] = ''
+        result = import_ods(make_ods(records_to_sheets(data)))
+        self.assertEqual(result.invalid[CourseParticipation], 1)
+        self.assertEqual(result.invalid[SeminarParticipation], 1)
+        self.assertEqual(CourseParticipation.objects.count(), 4)
+
+    def test_second_import_is_skipped(self):
+        content = make_ods(records_to_sheets(sample_data()))
+        import_ods(content)
+        counts = object_counts()
+        again = import_ods(content)
+        self.assertEqual(object_counts(), counts)
+        self.assertEqual(again.skipped_rows, 25)
+        self.assertFalse(any(again.created.values()))
+        self.assertEqual(import_ods(content, force=True).skipped_rows, 0)
+
+    def test_deleted_objects_are_imported_again(self):
+        content = make_ods(records_to_sheets(sample_data()))
+        import_ods(content)
+        CourseParticipation.objects.all().delete()
+        import_ods(content)
+        self.assertEqual(CourseParticipation.objects.count(), 5)
+
+    def test_batches_give_same_objects(self):
+        content = make_ods(records_to_sheets(sample_data()))
+        importer = BulkImporter(strict=False, force=False, flush_rows=3)
+        for kind, rec in route_records([parse_file(content, 'test.ods')]):
+            importer.add(kind, rec)
+        result = importer.run()
+        self.assertEqual(result.created[Education], 5)
+        self.assertEqual(result.created[CourseParticipation], 5)
+        self.assertEqual(object_counts()[User], 6)
+        self.assertEqual(import_ods(content).skipped_rows, 25)
+
+
+class ParticipationTestCase(TestCase):
+    def setUp(self):
+        self.student = User.objects.create(username='s', last_name='Иванова')
+        self.teacher = User.objects.create(username='t', last_name='Петров')
+        location = Location.objects.create(name='ЛНМО')
+        subject = Subject.objects.create(name='Математика')
+        self.course = Course.objects.create(name='Алгебра', location=location, subject=subject)
+
+    def participation(self, **kwargs) -> CourseParticipation:
+        fields = dict(student=self.student, course=self.course, started=datetime(2019, 9, 1),
+                      finished=datetime(2020, 5, 30), hours=10, teacher=self.teacher, mark='5')
+        fields.update(kwargs)
+        return CourseParticipation(**fields)
+
+
+class MergeTests(ParticipationTestCase):
+    def test_merge_moves_references_and_drops_duplicates(self):
+        twin = User.objects.create(username='s2', last_name='Иванова')
+        kept = self.participation()
+        kept.save()
+        # The same participation of the twin would duplicate the survivor's one
+        self.participation(student=twin).save()
+        moved = self.participation(student=twin, mark='4')
+        moved.save()
+
+        res = merge_objects('user', self.student.pk, [twin.pk])
+        self.assertEqual(res['merged'], 1)
+        self.assertFalse(User.objects.filter(pk=twin.pk).exists())
+        self.assertEqual(
+            sorted(CourseParticipation.objects.values_list('pk', 'student_id')),
+            [(kept.pk, self.student.pk), (moved.pk, self.student.pk)]
+        )
+
+    def test_merge_activities(self):
+        other = Course.objects.create(name='Алгебра ', location=self.course.location, subject=self.course.subject)
+        p = self.participation(course=other)
+        p.save()
+        merge_objects('course', self.course.pk, [other.pk])
+        p.refresh_from_db()
+        self.assertEqual(p.course_id, self.course.pk)
+        self.assertEqual(Course.objects.count(), 1)
+
+    def test_views_require_staff(self):
+        self.client.force_login(self.student)
+        for url in ['/tasks', '/tasks/edit/merge', '/tasks/dedupe_edu']:
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class NaturalKeyTests(ParticipationTestCase):
+    def test_duplicate_participation_is_refused(self):
+        self.participation().save()
+        with self.assertRaises(ValidationError):
+            self.participation().clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.participation().save()
+        self.participation(mark='4').save()
+        self.assertEqual(CourseParticipation.objects.count(), 2)
+
+    def test_duplicate_education_is_refused(self):
+        department = Department.objects.create(name='Площадка')
+        fields = dict(student=self.student, department=department, start_date=date(2015, 9, 1), start_class='7',
+                      finish_date=date(2020, 5, 30), finish_class='11')
+        Education.objects.create(**fields)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Education.objects.create(**fields)
+
+
+class BulkEditTests(ParticipationTestCase):
+    def test_bulk_edit(self):
+        p = self.participation()
+        p.save()
+        self.assertEqual(bulk_edit('courseparticipation', {'id__in': [p.pk]}, {'mark': '4'}, preview=True), 1)
+        self.assertEqual(bulk_edit('courseparticipation', {'course': self.course.pk}, {'mark': '4'}), 1)
+        p.refresh_from_db()
+        self.assertEqual(p.mark, '4')
+
+    def test_duplicates_are_refused(self):
+        self.participation(mark='5').save()
+        self.participation(mark='4').save()
+        with self.assertRaises(BulkEditException):
+            bulk_edit('courseparticipation', {'mark': '4'}, {'mark': '5'})
+        self.assertEqual(sorted(CourseParticipation.objects.values_list('mark', flat=True)), ['4', '5'])
+
+    def test_filters_are_limited_to_own_columns(self):
+        self.participation().save()
+        for filter_ in [{'student__password__startswith': 'p'}, {'course__name': 'Алгебра'},
+                        {'mark__startswith': '5'}, {'password': ''}]:
+            with self.assertRaises(BulkEditException):
+                bulk_edit('courseparticipation', filter_, {'mark': '4'}, preview=True)
+        with self.assertRaises(BulkEditException):
+            bulk_edit('user', {'id': self.student.pk}, {'is_staff': True})
+
+    def test_view_requires_staff(self):
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get('/tasks/edit/bulk').status_code, 403)
+        res = self.client.post('/tasks/edit/bulk', {
+            'object_type': 'courseparticipation', 'filter': json.dumps({'course': self.course.pk}),
+            'values': json.dumps({'mark': '4'}), 'preview': '1',
+        })
+        self.assertEqual(res.status_code, 403)
+
+
+class DedupeTests(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Площадка')
+        self.students = [User.objects.create(username=f's{i}') for i in range(2)]
+        for s in self.students:
+            Education.objects.create(student=s, department=self.department, start_date=date(2015, 9, 1),
+                                     start_class='7', finish_date=date(2016, 5, 30), finish_class='8')
+            Education.objects.create(student=s, department=self.department, start_date=date(2016, 9, 1),
+                                     start_class='8', finish_date=date(2017, 5, 30), finish_class='9')
+
+    def test_dry_run_keeps_educations(self):
+        self.assertEqual(dedupe_educations(dry_run=True)['deleted'], 2)
+        self.assertEqual(Education.objects.count(), 4)
+
+    def test_consecutive_educations_are_merged(self):
+        self.assertEqual(dedupe_educations()['deleted'], 2)
+        self.assertEqual(sorted(Education.objects.values_list('start_date', 'finish_date')),
+                         [(date(2015, 9, 1), date(2017, 5, 30))] * 2)
+
+    def test_only_given_students(self):
+        res = dedupe_educations(student_ids=[self.students[0].pk])
+        self.assertEqual(res['deleted'], 1)
+        self.assertEqual(Education.objects.filter(student=self.students[0]).count(), 1)
+        self.assertEqual(Education.objects.get(student=self.students[0]).finish_date, date(2017, 5, 30))
+        self.assertEqual(Education.objects.filter(student=self.students[1]).count(), 2)
+
+
+class SparseRowTests(TestCase):
+    def test_sequence(self):
+        cells = ['a', 'a', 'b', '', '', '', 'c'] + [''] * 1000
+        row = SparseRow()
+        for c in cells:
+            row.append(c)
+        self.assertEqual(len(row.runs), 5)
+        self.assertEqual(len(row), len(cells))
+        self.assertEqual(list(row), cells)
+        self.assertEqual([row[i] for i in range(-3, 8)], cells[-3:] + cells[:8])
+        for start, stop in [(0, 0), (1, 5), (2, 7), (3, 1007), (6, 2000), (-5, None)]:
+            self.assertEqual(list(row[start:stop]), cells[start:stop])
+        with self.assertRaises(IndexError):
+            row[len(cells)]
+
+
+class OdsDocumentTests(TestCase):
+    def odfpy_rows(self, content: bytes, sheet_name: str) -> list[list[str]]:
+        # Reference: the same rows read with odfpy, repeated rows expanded unless empty
+        doc = load(io.BytesIO(content))
+        table = [t for t in doc.spreadsheet.getElementsByType(Table) if t.getAttribute('name') == sheet_name][0]
+        res = []
+        for tr in table.getElementsByType(TableRow):
+            row = []
+            for cell in tr.getElementsByType(TableCell):
+                text = ''.join(str(p) for p in cell.getElementsByType(P))
+                row += [text] * int(cell.getAttribute('numbercolumnsrepeated') or 1)
+            repeat = int(tr.getAttribute('numberrowsrepeated') or 1)
+            res += [row] * (repeat if any(row) else 1)
+        return res
+
+    def test_rows_equal_odfpy(self):
+        rnd = random.Random(1)
+        sheets = {
+            name: [[rnd.choice(['', 'x', 'Иванов', ' y ']) for _ in range(rnd.randint(0, 8))] for _ in range(50)]
+            for name in ['Первый', 'Второй', 'Третий']
+        }
+        content = make_ods(sheets, repeated_rows={3: 4, 7: 2})
+        doc = OdsDocument(io.BytesIO(content))
+        self.assertEqual(doc.sheet_names(), list(sheets))
+        for name in sheets:
+            self.assertEqual([list(r) for r in doc.rows(name)], self.odfpy_rows(content, name))
+        with self.assertRaises(KeyError):
+            doc.rows('Нет такого')
+
+    def test_sheets_in_any_order(self):
+        content = make_ods({'a': [['1'], ['2']], 'b': [['3'], ['4']], 'c': [['5']]})
+        doc = OdsDocument(io.BytesIO(content))
+        first = lambda rows: [list(r)[0] for r in rows]
+        partly = doc.rows('b')
+        self.assertEqual(list(next(partly))[0], '3')
+        self.assertEqual(first(doc.rows('c')), ['5'])
+        self.assertEqual(first(partly), [])  # read until the next rows() call only
+        self.assertEqual(first(doc.rows('a')), ['1', '2'])
+        self.assertEqual(first(doc.rows('b')), ['3', '4'])
+        self.assertEqual(doc.sheet_names(), ['a', 'b', 'c'])
+
+
+def similar_strings(n: int, seed: int = 1) -> list[str]:
+    rnd = random.Random(seed)
+    surnames = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов']
+    names = ['Александр', 'Алексей', 'Андрей', 'Дмитрий', 'Иван']
+    strings = [f'{rnd.choice(surnames)}{rnd.choice(["", "ин", "ский"])} {rnd.choice(names)}' for _ in range(n)]
+    for k in range(n // 10):
+        s = strings[rnd.randrange(n)]
+        i = rnd.randrange(len(s))
+        strings.append(s[:i] + rnd.choice('абв') + s[i + 1:])  # a typo
+    return strings
+
+
+class SimilarityTests(TestCase):
+    def test_blocking_finds_typos(self):
+        strings = similar_strings(200)
+        normalized = [normalize_string(s) for s in strings]
+        pairs = candidate_pairs(normalized)
+        for i in range(200, len(strings)):
+            original = [j for j in range(200) if strings[j] != strings[i]
+                        and len(strings[j]) == len(strings[i])
+                        and sum(a != b for a, b in zip(strings[j], strings[i])) == 1]
+            for j in original:
+                self.assertIn((min(i, j), max(i, j)), pairs)
+
+    def test_top_pairs_match_brute_force(self):
+        strings = similar_strings(60)
+        _, score = make_scorer('ratio')
+        brute = sorted(
+            ((score(strings[i], strings[j]), i, j) for i, j in all_pairs(len(strings))),
+            key=lambda x: (-x[0], x[1], x[2])
+        )
+        for limit in [1, 10, 100]:
+            res = top_pairs(limit, strings, all_pairs(len(strings)), score, batch_size=37)
+            self.assertEqual(res, brute[:limit])
+
+    def test_workers_give_same_pairs(self):
+        strings = similar_strings(100)
+        calls = []
+        parallel = find_nearest_strings(20, strings, workers=2, progress=lambda done, total: calls.append(done))
+        self.assertEqual(parallel, find_nearest_strings(20, strings))
+        self.assertTrue(calls)
 
-# Create your tests here.
+    def test_rerank_keeps_exhaustive_scores(self):
+        strings = similar_strings(150)
+        for method in ['ratio', 'WRatio', 'token_sort_ratio']:
+            exact = find_nearest_strings(20, strings, method, exhaustive=True)
+            blocked = find_nearest_strings(20, strings, method)
+            self.assertEqual([s for s, _, _ in blocked], [s for s, _, _ in exact], method)
@@ -17,6 +17,8 @@ urlpatterns = [
     path('tasks', views.tasks),
     path('tasks/dedupe_edu', views.dedupe_edu),
     path('tasks/find_similar_objects/<str:obj_type>/<str:method>/<int:limit>', views.find_similar_objects),
+    path('tasks/similar_objects/<int:candidate_id>/dismiss', views.dismiss_similar_objects),
+    path('tasks/progress/<str:task_id>', views.task_progress),
     path('tasks/check_names', views.check_names),
     path('tasks/edit/merge', views.edit_merge),
     path('tasks/edit/bulk', views.edit_bulk),
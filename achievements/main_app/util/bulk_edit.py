@@ -0,0 +1,107 @@
+# Set-based editing: a filter and field assignments become one UPDATE per table
+from typing import Any
+
+from django.core.exceptions import FieldError, ValidationError
+from django.db import models, transaction, IntegrityError
+
+from ..models import Participation
+from .dashboard import invalidate_dashboard_stats
+from .natural_keys import refresh_natural_keys
+from .similarity import obj_type_projection_map
+from .similarity_index import similarity_index_exists, update_similarity_index_for_model
+
+
+# Account fields are only changed through the admin
+excluded_fields = {'password', 'last_login', 'is_superuser', 'is_staff', 'is_active'}
+
+# Filters compare the model's own columns only: lookups through relations or on other
+# columns would let the preview count reveal values (e.g. password hashes) bit by bit
+filter_lookups = {'exact', 'in'}
+
+
+class BulkEditException(Exception):
+    pass
+
+
+def bulk_edit_fields(model: type) -> list[models.Field]:
+    # Plain columns and foreign keys, including the ones of multi-table parents
+    return [
+        f
+        for f in model._meta.concrete_fields
+        if not f.primary_key and f.editable and f.name not in excluded_fields
+        and not getattr(f.remote_field, 'parent_link', False)
+    ]
+
+
+def bulk_filter_fields(model: type) -> set[str]:
+    # The primary keys include the parents' ones with multi-table inheritance ("id")
+    names = {'pk'} | {f.name for f in model._meta.concrete_fields if f.primary_key}
+    for f in bulk_edit_fields(model):
+        names.add(f.name)
+        names.add(f.attname)  # <fk>_id
+    return names
+
+
+def check_filter(model: type, filter_: dict[str, Any]):
+    fields = bulk_filter_fields(model)
+    for key in filter_:
+        name, _, lookup = key.partition('__')
+        if name not in fields or (lookup and lookup not in filter_lookups):
+            raise BulkEditException(f'Bad filter: {key}')
+
+
+def bulk_edit_queryset(obj_type: str, filter_: dict[str, Any]) -> models.QuerySet:
+    if obj_type not in obj_type_projection_map:
+        raise BulkEditException(f'Bad object type: {obj_type}')
+    if not isinstance(filter_, dict) or not filter_:
+        raise BulkEditException('Empty filter')  # Protects from editing the whole table by mistake
+
+    model = obj_type_projection_map[obj_type][0]
+    check_filter(model, filter_)
+    try:
+        qs = model.objects.filter(**filter_)
+        str(qs.query)  # Resolves the lookups
+    except (FieldError, ValidationError, ValueError, TypeError) as e:
+        raise BulkEditException(f'Bad filter: {e}')
+    return qs
+
+
+def clean_bulk_values(model: type, values: dict[str, Any]) -> dict[str, Any]:
+    if not isinstance(values, dict) or not values:
+        raise BulkEditException('Nothing to change')
+
+    fields = {f.name: f for f in bulk_edit_fields(model)}
+    res = {}
+    for name, value in values.items():
+        if name not in fields:
+            raise BulkEditException(f'Bad field: {name}')
+
+        f = fields[name]
+        try:
+            res[f.attname] = f.clean(value, None)
+        except ValidationError as e:
+            raise BulkEditException(f'{name}: {" ".join(e.messages)}')
+    return res
+
+
+def bulk_edit(obj_type: str, filter_: dict[str, Any], values: dict[str, Any], preview: bool = False) -> int:
+    qs = bulk_edit_queryset(obj_type, filter_)
+    values = clean_bulk_values(qs.model, values)
+
+    if preview:
+        return qs.count()
+
+    indexed = similarity_index_exists(qs.model)
+    keyed = issubclass(qs.model, Participation)
+    try:
+        with transaction.atomic():
+            ids = list(qs.values_list('pk', flat=True)) if indexed or keyed else []
+            count = qs.update(**values)
+            if keyed:
+                refresh_natural_keys(qs.model, ids)
+    except IntegrityError:
+        raise BulkEditException('The changes would make some of the objects duplicates')
+
+    update_similarity_index_for_model(qs.model, ids if indexed else [])
+    invalidate_dashboard_stats()
+    return count
@@ -0,0 +1,481 @@
+# Bulk import: rows are parsed into the records of records.py and written in batches of
+# FLUSH_ROWS. For a batch every natural key is resolved with a few IN queries and the
+# missing objects are created with bulk_create in dependency order
+# (users -> departments/subjects/locations -> activities -> educations/participations).
+# Only the primary keys of the referenced objects are kept between the batches.
+# Educations and participations have unique natural keys and are inserted ignoring conflicts.
+# Rows and files imported before are recognized by their fingerprints and skipped.
+# The result is counters per model and a few display names, not the objects themselves.
+import hashlib
+import logging
+from collections import Counter
+from typing import Iterable, Tuple, Any, Callable
+
+from django.db import models, transaction, router, connections
+from django.db.models import Max
+
+from ..models import *
+from .data_import import DataFormatException
+from .natural_keys import compute_natural_key, participation_natural_key_fields
+from .records import Record, Person, EducationRecord, CourseRecord, SeminarRecord, ProjectRecord, OlympiadRecord, \
+    record_types
+from .similarity import fetch_projected_strings
+from .similarity_index import update_similarity_indexes
+from .util import chunks
+
+IN_CHUNK_SIZE = 1000
+BULK_BATCH_SIZE = 1000
+RESULT_SAMPLE_SIZE = 20  # Display names shown per model after an import
+FLUSH_ROWS = 5000  # Parsed rows kept before they are written
+
+# Natural keys are tuples of these fields' values, a foreign key value being the natural
+# key of the referenced object. The first field is the one looked up with IN.
+natural_key_fields: dict[type, list[str]] = {
+    Department: ['name'],
+    Subject: ['name'],
+    Location: ['name'],
+    Course: ['name', 'location', 'chapter', 'subject'],
+    Seminar: ['name', 'location', 'subject'],
+    Project: ['name', 'location', 'subject'],
+    Olympiad: ['name', 'location', 'stage'],
+    Education: ['student', 'department', 'start_date', 'start_class', 'finish_date', 'finish_class'],
+    CourseParticipation: participation_natural_key_fields['CourseParticipation'],
+    SeminarParticipation: participation_natural_key_fields['SeminarParticipation'],
+    ProjectParticipation: participation_natural_key_fields['ProjectParticipation'],
+    OlympiadParticipation: participation_natural_key_fields['OlympiadParticipation'],
+}
+
+# Models with unique natural keys (a constraint or Participation.natural_key)
+unique_key_models = {Education, CourseParticipation, SeminarParticipation, ProjectParticipation, OlympiadParticipation}
+
+# Users go first, every model only references the ones before it
+import_order = list(natural_key_fields)
+user_fields = ['first_name', 'middle_name', 'last_name', 'phone_number', 'email']
+
+person = Tuple[Tuple[str], dict[str, str]]  # ((username,), user fields)
+ref = Tuple[type, tuple]  # (model, natural key)
+
+
+def person_of(p: Person) -> person:
+    return (p.username,), p.fields()
+
+
+def parse_education(rec: EducationRecord) -> Tuple[list[person], list[ref]]:
+    student = person_of(rec.student)
+    dep = (rec.department,)
+    edu = (student[0], dep, rec.start_date, rec.start_class, rec.finish_date, rec.finish_class)
+    return [student], [(User, student[0]), (Department, dep), (Education, edu)]
+
+
+def parse_course(rec: CourseRecord) -> Tuple[list[person], list[ref]]:
+    location = (rec.location,)
+    subject = (rec.subject,)
+    student = person_of(rec.student)
+    teacher = person_of(rec.teacher)
+
+    course = (rec.name, location, rec.chapter, subject)
+    cp = (student[0], course, rec.started, rec.finished, rec.hours, teacher[0], rec.mark, rec.is_exam)
+    return [student, teacher], [
+        (User, student[0]), (User, teacher[0]), (Subject, subject), (Location, location),
+        (Course, course), (CourseParticipation, cp)
+    ]
+
+
+def parse_seminar(rec: SeminarRecord) -> Tuple[list[person], list[ref]]:
+    location = (rec.location,)
+    subject = (rec.subject,)
+    student = person_of(rec.student)
+    teacher = person_of(rec.teacher)
+
+    seminar = (rec.name, location, subject)
+    sp = (student[0], seminar, rec.started, rec.finished, rec.hours, teacher[0], rec.mark)
+    return [student, teacher], [
+        (User, student[0]), (User, teacher[0]), (Subject, subject), (Location, location),
+        (Seminar, seminar), (SeminarParticipation, sp)
+    ]
+
+
+def parse_project(rec: ProjectRecord) -> Tuple[list[person], list[ref]]:
+    location = (rec.location,)
+    subject = (rec.subject,)
+    student = person_of(rec.student)
+    curator = person_of(rec.curator)
+
+    project = (rec.name, location, subject)
+    pp = (student[0], project, rec.started, rec.finished, curator[0])
+    return [student, curator], [
+        (User, student[0]), (User, curator[0]), (Subject, subject), (Location, location),
+        (Project, project), (ProjectParticipation, pp)
+    ]
+
+
+def parse_olympiad(rec: OlympiadRecord) -> Tuple[list[person], list[ref]]:
+    location = (rec.location,)
+    student = person_of(rec.student)
+
+    olympiad = (rec.name, location, rec.stage)
+    op = (student[0], olympiad, rec.started, rec.finished, rec.title, rec.prize, rec.is_team_member)
+    return [student], [(User, student[0]), (Location, location), (Olympiad, olympiad), (OlympiadParticipation, op)]
+
+
+row_parsers: dict[str, Callable[[Record], Tuple[list[person], list[ref]]]] = {
+    'education': parse_education,
+    'course': parse_course,
+    'seminar': parse_seminar,
+    'project': parse_project,
+    'olympiad': parse_olympiad,
+}
+
+# The object a row produces (the last of its refs)
+row_models: dict[str, type] = {
+    'education': Education,
+    'course': CourseParticipation,
+    'seminar': SeminarParticipation,
+    'project': ProjectParticipation,
+    'olympiad': OlympiadParticipation,
+}
+
+
+def row_fingerprint(kind: str, people: list[person], refs: list[ref]) -> str:
+    # Parsed rows are already normalized (stripped, capitalized, typed), so cosmetic
+    # differences in the cells do not change the fingerprint
+    data = repr((kind, people, [(model._meta.label, key) for model, key in refs]))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def file_digest(content: bytes, use_old_format: bool = False) -> str:
+    # The same file gives different rows in the old format
+    h = hashlib.sha256(b'old:' if use_old_format else b'new:')
+    h.update(content)
+    return h.hexdigest()
+
+
+def imported_file_digests(digests: Iterable[str]) -> set[str]:
+    return set(ImportedFile.objects.filter(digest__in=list(digests)).values_list('digest', flat=True))
+
+
+def record_imported_files(files: Iterable[Tuple[str, str]]):
+    for name, digest in files:
+        ImportedFile.objects.update_or_create(digest=digest, defaults={'name': name})
+
+
+def bulk_create_mti(model: type, objs: list[models.Model], batch_size: int = BULK_BATCH_SIZE, unique_field: str = None):
+    # bulk_create does not support multi-table inheritance: the parent rows are created
+    # in bulk first, then the child rows are inserted with the parents' primary keys.
+    # With a unique parent field the rows already present are kept and their keys used.
+    parent_link = model._meta.pk
+    parent = parent_link.related_model
+    parent_objs = [
+        parent(**{f.attname: getattr(o, f.attname) for f in parent._meta.concrete_fields if not f.primary_key})
+        for o in objs
+    ]
+    ignore_conflicts = unique_field is not None
+    parent.objects.bulk_create(parent_objs, batch_size=batch_size, ignore_conflicts=ignore_conflicts)
+
+    if ignore_conflicts:
+        # Primary keys are not returned when conflicts are ignored, so they are selected back
+        pks = {}
+        for chunk in chunks([getattr(p, unique_field) for p in parent_objs], IN_CHUNK_SIZE):
+            pks.update(
+                parent._base_manager
+                    .filter(**{f'{unique_field}__in': chunk})
+                    .values_list(unique_field, 'pk')
+            )
+        for p in parent_objs:
+            p.pk = pks[getattr(p, unique_field)]
+
+    for o, p in zip(objs, parent_objs):
+        setattr(o, parent._meta.pk.attname, p.pk)
+        setattr(o, parent_link.attname, p.pk)
+
+    db = router.db_for_write(model)
+    fields = model._meta.local_concrete_fields
+    size = max(1, min(batch_size, connections[db].ops.bulk_batch_size(fields, objs)))
+    for batch in chunks(objs, size):
+        model._base_manager._insert(batch, fields=fields, using=db, ignore_conflicts=ignore_conflicts)
+
+    for o in objs:
+        o._state.adding = False
+        o._state.db = db
+
+
+def bulk_create_objects(model: type, objs: list[models.Model]):
+    if model._meta.parents:
+        bulk_create_mti(model, objs)
+    else:
+        model.objects.bulk_create(objs, batch_size=BULK_BATCH_SIZE)
+
+
+def bulk_insert_ignoring_conflicts(model: type, objs: list[models.Model], attnames: list[str]) -> list[models.Model]:
+    # Inserts the objects unless rows with the same unique natural key exist, then sets the
+    # primary keys of all of them. The database decides, so concurrent imports can not
+    # create duplicates and no existence check is needed beforehand.
+    # Returns the inserted ones: primary keys only grow, so those are the ones above the
+    # last primary key before the insert.
+    if not objs:
+        return []
+    last_pk = model._base_manager.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+
+    if model._meta.parents:
+        for o in objs:
+            o.natural_key = compute_natural_key(o)
+        bulk_create_mti(model, objs, unique_field='natural_key')
+    else:
+        model.objects.bulk_create(objs, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+        pks = {}
+        for chunk in chunks(sorted({getattr(o, attnames[0]) for o in objs}), IN_CHUNK_SIZE):
+            rows = model._base_manager \
+                .filter(**{f'{attnames[0]}__in': chunk}) \
+                .values_list('pk', *attnames)
+            for pk, *values in rows:
+                pks[tuple(values)] = pk
+        for o in objs:
+            o.pk = pks[tuple(getattr(o, a) for a in attnames)]
+            o._state.adding = False
+
+    return [o for o in objs if o.pk > last_pk]
+
+
+class ImportResult:
+    def __init__(self):
+        # Objects by model
+        self.created = Counter()
+        self.updated = Counter()
+        self.existing = Counter()
+        # Rows by the model they produce
+        self.skipped = Counter()  # imported before, or earlier in the same import
+        self.invalid = Counter()  # not parsed, only when not strict
+        # A few display names by model, the created objects first
+        self.samples: dict[type, list[str]] = {}
+        # Students whose educations were imported (stored or already present)
+        self.education_student_ids: set[int] = set()
+
+    @property
+    def skipped_rows(self) -> int:
+        return sum(self.skipped.values())
+
+    @property
+    def invalid_rows(self) -> int:
+        return sum(self.invalid.values())
+
+    def models(self) -> list[type]:
+        return [m for m in [User] + import_order if self.created[m] or self.updated[m] or self.existing[m] or self.skipped[m]]
+
+
+class BulkImporter:
+    def __init__(self, strict=True, force=False, flush_rows=FLUSH_ROWS):
+        self.strict = strict
+        self.force = force  # Imports the rows with known fingerprints again
+        self.flush_rows = flush_rows
+        # The batch: parsed rows, then what they refer to
+        self.parsed: list[Tuple[str, str, list[person], list[ref]]] = []  # (kind, fingerprint, people, refs)
+        self.people: dict[tuple, dict[str, str]] = {}  # the last row wins, as with sequential saves
+        self.keys: dict[type, set[tuple]] = {m: set() for m in import_order}
+        self.rows: list[list[ref]] = []
+        self.row_fingerprints: list[Tuple[str, str]] = []  # (kind, fingerprint) of each of the rows
+        self.changed: dict[type, set[int]] = {}  # created and updated ids, for the similarity index
+        # Primary keys by natural key, of the referenced models for the whole import. The model
+        # instances are only kept while they are written.
+        self.pks: dict[type, dict[tuple, int]] = {}
+        self.changed_users: set[int] = set()  # created or counted as updated before
+        self.result = ImportResult()
+        self.sample_ids: dict[type, Tuple[list[int], list[int]]] = {}  # (created/updated, the rest)
+
+    def add(self, kind: str, data: dict[str, str]) -> bool:
+        try:
+            people, refs = row_parsers[kind](record_types[kind](data))
+        except Exception as e:
+            if self.strict:
+                if isinstance(e, DataFormatException):
+                    raise
+                raise DataFormatException(f'Ошибка импорта: {type(e).__name__}: {e}')
+            logging.getLogger(__name__).info(f"Skipped record ({kind}): {type(e).__name__}: {e}")
+            self.result.invalid[row_models[kind]] += 1
+            return False
+
+        self.parsed.append((kind, row_fingerprint(kind, people, refs), people, refs))
+        if len(self.parsed) >= self.flush_rows:
+            self.flush()
+        return True
+
+    def collect(self, kind: str, fingerprint: str, people: list[person], refs: list[ref]):
+        for key, fields in people:
+            self.people.setdefault(key, {}).update(fields)
+        for model, key in refs:
+            if model is not User:
+                self.keys[model].add(key)
+        self.rows.append(refs)
+        self.row_fingerprints.append((kind, fingerprint))
+
+    def known_fingerprints(self) -> set[str]:
+        # Fingerprints of the rows imported before, unless their objects were deleted since
+        fingerprint_ids: dict[str, dict[int, list[str]]] = {}  # kind -> object id -> fingerprints
+        for chunk in chunks(sorted({p[1] for p in self.parsed}), IN_CHUNK_SIZE):
+            rows = ImportFingerprint.objects \
+                .filter(fingerprint__in=chunk) \
+                .values_list('fingerprint', 'kind', 'object_id')
+            for fingerprint, kind, object_id in rows:
+                fingerprint_ids.setdefault(kind, {}).setdefault(object_id, []).append(fingerprint)
+
+        known = set()
+        for kind, ids in fingerprint_ids.items():
+            model = row_models[kind]
+            for chunk in chunks(sorted(ids), IN_CHUNK_SIZE):
+                for pk in model._base_manager.filter(pk__in=chunk).values_list('pk', flat=True):
+                    known.update(ids[pk])
+        return known
+
+    def save_fingerprints(self):
+        fingerprints = {}
+        for (kind, fingerprint), refs in zip(self.row_fingerprints, self.rows):
+            model, key = refs[-1]
+            fingerprints[fingerprint] = ImportFingerprint(
+                fingerprint=fingerprint,
+                kind=kind,
+                object_id=self.pks[model][key],
+            )
+
+        # Stale fingerprints (of deleted objects) are replaced
+        for chunk in chunks(sorted(fingerprints), IN_CHUNK_SIZE):
+            ImportFingerprint.objects.filter(fingerprint__in=chunk).delete()
+        ImportFingerprint.objects.bulk_create(fingerprints.values(), batch_size=BULK_BATCH_SIZE)
+
+    def resolve_users(self):
+        existing: dict[str, User] = {}
+        for chunk in chunks(sorted(k[0] for k in self.people), IN_CHUNK_SIZE):
+            for u in User.objects.filter(username__in=chunk):
+                existing[u.username] = u
+
+        known = self.pks.setdefault(User, {})
+        new = {}
+        changed = []
+        unchanged = []
+        for key, fields in self.people.items():
+            u = existing.get(key[0])
+            if u is None:
+                # Students and teachers do not log in, issue_credentials gives them passwords
+                u = User(username=key[0], **fields)
+                u.set_unusable_password()
+                new[key] = u
+                continue
+            if any(getattr(u, f) != v for f, v in fields.items()):
+                for f, v in fields.items():
+                    setattr(u, f, v)
+                changed.append(u)
+            elif key not in known:
+                unchanged.append(u.pk)
+            known[key] = u.pk
+
+        User.objects.bulk_create(new.values(), batch_size=BULK_BATCH_SIZE)
+        User.objects.bulk_update(changed, user_fields, batch_size=BULK_BATCH_SIZE)
+        known.update((key, u.pk) for key, u in new.items())
+
+        created = [u.pk for u in new.values()]
+        # Users of several batches are counted once
+        updated = [u.pk for u in changed if u.pk not in self.changed_users]
+        self.changed_users.update(created + updated)
+        self.count(User, created, updated, unchanged)
+        self.changed.setdefault(User, set()).update(u.pk for u in changed)
+
+    def fetch_existing(self, model: type, attnames: list[str], db_keys: set[tuple]) -> dict[tuple, int]:
+        # Primary keys of the stored objects by their natural keys (in database values)
+        existing = {}
+        for chunk in chunks(sorted({k[0] for k in db_keys}), IN_CHUNK_SIZE):
+            rows = model._base_manager \
+                .filter(**{f'{attnames[0]}__in': chunk}) \
+                .order_by('-pk') \
+                .values_list('pk', *attnames)
+            for pk, *values in rows:
+                key = tuple(values)
+                if key in db_keys:
+                    existing[key] = pk  # The oldest object wins
+        return existing
+
+    def resolve(self, model: type):
+        fields = [model._meta.get_field(f) for f in natural_key_fields[model]]
+        attnames = [f.attname for f in fields]
+        known = self.pks.setdefault(model, {})
+        # Natural keys in database values, the referenced objects are resolved already
+        db_keys = {
+            key: tuple(self.pks[f.related_model][v] if f.is_relation else v for f, v in zip(fields, key))
+            for key in self.keys[model]
+            if key not in known
+        }
+        self.keys[model] = set()
+
+        if model in unique_key_models:
+            objs = {key: model(**dict(zip(attnames, db_key))) for key, db_key in db_keys.items()}
+            created = {o.pk for o in bulk_insert_ignoring_conflicts(model, list(objs.values()), attnames)}
+            known.update((key, o.pk) for key, o in objs.items())
+            self.count(model, sorted(created), [], [o.pk for o in objs.values() if o.pk not in created])
+            if model is Education:
+                self.result.education_student_ids.update(o.student_id for o in objs.values())
+            return
+
+        existing = self.fetch_existing(model, attnames, set(db_keys.values()))
+        new = {}
+        for key, db_key in db_keys.items():
+            pk = existing.get(db_key)
+            if pk is None:
+                new[key] = model(**dict(zip(attnames, db_key)))
+            else:
+                known[key] = pk
+
+        bulk_create_objects(model, list(new.values()))
+        known.update((key, o.pk) for key, o in new.items())
+        self.count(model, [o.pk for o in new.values()], [], list(existing.values()))
+
+    def count(self, model: type, created: list[int], updated: list[int], existing: list[int]):
+        self.result.created[model] += len(created)
+        self.result.updated[model] += len(updated)
+        self.result.existing[model] += len(existing)
+        self.changed.setdefault(model, set()).update(created + updated)
+
+        # The created and updated objects are sampled before the rest
+        first, rest = self.sample_ids.setdefault(model, ([], []))
+        first.extend((created + updated)[:RESULT_SAMPLE_SIZE - len(first)])
+        rest.extend(existing[:RESULT_SAMPLE_SIZE - len(rest)])
+
+    def fetch_samples(self):
+        # One query per model, with the same strings as the models' __str__
+        for model, (first, rest) in self.sample_ids.items():
+            ids = (first + [pk for pk in rest if pk not in first])[:RESULT_SAMPLE_SIZE]
+            if ids:
+                names = dict(fetch_projected_strings(model.__name__.lower(), ids))
+                self.result.samples[model] = [names[pk] for pk in ids if pk in names]
+
+    def flush(self):
+        # Writes the batch and forgets it. Rows repeating ones of earlier batches are
+        # skipped by their fingerprints, as if imported before.
+        known = set() if self.force else self.known_fingerprints()
+        for kind, fingerprint, people, refs in self.parsed:
+            if fingerprint in known:
+                self.result.skipped[row_models[kind]] += 1
+            else:
+                self.collect(kind, fingerprint, people, refs)
+        self.parsed = []
+
+        with transaction.atomic():
+            self.resolve_users()
+            for model in import_order:
+                self.resolve(model)
+            self.save_fingerprints()
+            update_similarity_indexes(self.changed)
+
+        self.people = {}
+        self.rows = []
+        self.row_fingerprints = []
+        self.changed = {}
+        for model in unique_key_models:
+            self.pks.pop(model, None)  # nothing refers to them, so only the batch needs their keys
+
+    def run(self) -> ImportResult:
+        # Writes the last batch. The batches are written in separate transactions unless
+        # the caller opens one around the whole import.
+        self.flush()
+        self.fetch_samples()
+
+        self.pks = {}
+        self.changed_users = set()
+        self.sample_ids = {}
+        return self.result
@@ -0,0 +1,65 @@
+# Cached counters for the landing page
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+
+from ..models import Education, Course, Project, Olympiad, Seminar
+
+DASHBOARD_STATS_CACHE_KEY = 'main_app:dashboard_stats'
+
+# Models whose writes change the counters shown on the landing page
+DASHBOARD_STATS_MODELS = [Education, Course, Project, Olympiad, Seminar]
+
+
+def dashboard_stats_ttl() -> int:
+    return getattr(settings, 'DASHBOARD_STATS_TTL', 300)
+
+
+def count_dashboard_stats() -> dict[str, int]:
+    if not getattr(settings, 'DASHBOARD_STATS_CONSOLIDATED', True):
+        return {
+            'students': Education.objects.values('student_id').distinct().count(),
+            'courses': Course.objects.count(),
+            'projects': Project.objects.count(),
+            'olympiads': Olympiad.objects.count(),
+            'seminars': Seminar.objects.count(),
+        }
+
+    # All five counters in a single round trip
+    sql = f'''
+        SELECT
+            (SELECT COUNT(DISTINCT student_id) FROM {Education._meta.db_table}),
+            (SELECT COUNT(*) FROM {Course._meta.db_table}),
+            (SELECT COUNT(*) FROM {Project._meta.db_table}),
+            (SELECT COUNT(*) FROM {Olympiad._meta.db_table}),
+            (SELECT COUNT(*) FROM {Seminar._meta.db_table})
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        (students, courses, projects, olympiads, seminars) = cursor.fetchone()
+
+    return {
+        'students': students,
+        'courses': courses,
+        'projects': projects,
+        'olympiads': olympiads,
+        'seminars': seminars,
+    }
+
+
+def get_dashboard_stats() -> dict[str, int]:
+    stats = cache.get(DASHBOARD_STATS_CACHE_KEY)
+    if stats is None:
+        stats = count_dashboard_stats()
+        cache.set(DASHBOARD_STATS_CACHE_KEY, stats, dashboard_stats_ttl())
+    return stats
+
+
+def invalidate_dashboard_stats(**kwargs):
+    cache.delete(DASHBOARD_STATS_CACHE_KEY)
+
+
+for m in DASHBOARD_STATS_MODELS:
+    post_save.connect(invalidate_dashboard_stats, sender=m, dispatch_uid=f'dashboard_stats_save_{m.__name__}')
+    post_delete.connect(invalidate_dashboard_stats, sender=m, dispatch_uid=f'dashboard_stats_delete_{m.__name__}')
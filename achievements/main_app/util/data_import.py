@@ -1,20 +1,19 @@
+import io
 import logging
 import os
 import pathlib
-import sys
 import traceback
+from collections import deque
 from datetime import datetime
 from logging import Logger
 from traceback import print_exc
-from typing import Iterable, Tuple, Any
+from typing import Iterable, Iterator, Tuple, Any
 
-from odf import opendocument
 from odf.element import Element
-from odf.opendocument import OpenDocumentText, OpenDocumentSpreadsheet
-from odf.table import Table, TableRow, TableCell
 
 from ..models import *
-from .util import add_to_dict_multival
+from .ods import OdsDocument, SparseRow
+from .util import add_to_dict_multival, process_pool
 
 
 class DataFormatException(Exception):
@@ -48,31 +47,10 @@ def make_username(first_name: str, middle_name: str, last_name: str) -> str:
 
 
 def generate_password(length: int = 10) -> str:
-    import random
+    import secrets
 
     alph = '123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-    pw = ''
-    for i in range(length):
-        i = random.randint(0, len(alph) - 1)
-        pw += alph[i]
-
-    return pw
-
-
-def get_sheet_by_idx( doc, sheetIndex ):
-    try:
-        spreadsheet = doc.spreadsheet
-    except NameError:
-        sys.stderr.write("Error: file is not a spreadsheet\n")
-        return
-
-    sheets = spreadsheet.getElementsByType( Table )
-    if sheetIndex > len( sheets ):
-        sys.stderr.write( "Error: spreadsheet has only %d sheets; requested invalid sheet %d\n" % (len( sheets ), sheetIndex + 1) )
-        return
-
-    sheet = sheets[sheetIndex]
-    return sheet
+    return ''.join(secrets.choice(alph) for _ in range(length))
 
 
 def get_element_attribute(elem: Element, key: str) -> str:
@@ -82,36 +60,9 @@ def get_element_attribute(elem: Element, key: str) -> str:
             return elem.attributes[k]
 
 
-def get_sheet_name(sheet: Element) -> str:
-    return get_element_attribute(sheet, 'name')
-
-
-def doc_get_sheets(doc: OpenDocumentSpreadsheet) -> Iterable[Table]:
-    return doc.spreadsheet.getElementsByType( Table )
-
-
-def doc_get_sheet_names(doc: OpenDocumentSpreadsheet) -> Iterable[str]:
-    for s in doc_get_sheets(doc):
-        yield get_sheet_name(s)
-
-
-def get_sheet_by_name( doc: OpenDocumentSpreadsheet, sheet_name: str ):
-    try:
-        spreadsheet = doc.spreadsheet
-    except NameError:
-        sys.stderr.write("Error: file is not a spreadsheet\n")
-        return
-
-    sheets = doc_get_sheets(doc)
-
-    for s in sheets:
-        if get_sheet_name(s) == sheet_name:
-            return s
-
-
 record = dict[str, str]
 csv_data = list[record]
-list2d = list[list[str]]
+list2d = list[SparseRow]
 
 
 def ints(start=0) -> Iterable[int]:
@@ -125,32 +76,26 @@ def it_ix(it: Iterable[Any]) -> Iterable[Tuple[int, Any]]:
     return zip( ints(), it )
 
 
-def row_to_strings(row: TableRow, empty_cell_stop_threshhold=10) -> list[str]:
-    res = []
+def row_to_strings(row: SparseRow, empty_cell_stop_threshhold=10) -> SparseRow:
+    res = SparseRow()
     empty_cnt = 0
-    for cell in row.getElementsByType(TableCell):
-        mul = get_element_attribute(cell, 'number-columns-repeated')
-        mul = int(mul) if mul else 1
-
-        txt = str(cell)
+    for txt, mul in row.runs:
         if txt == '':
             if empty_cnt + mul >= empty_cell_stop_threshhold:
-                return res[0:-empty_cnt] if empty_cnt > 0 else res
+                return res[0:len(res) - empty_cnt]
 
             empty_cnt += mul
         else:
             empty_cnt = 0
 
-
-        for i in range(mul):
-            res.append(txt)
+        res.append(txt, mul)
 
     return res
 
 
-def sheet_to_list2d(sheet: Table) -> list2d:
+def sheet_to_list2d(rows: Iterable[SparseRow]) -> list2d:
     res = []
-    for row in sheet.getElementsByType(TableRow):
+    for row in rows:
         strs = row_to_strings(row)
         if len(strs) <= 0:
             continue
@@ -160,27 +105,17 @@ def sheet_to_list2d(sheet: Table) -> list2d:
 
 
 def list2d_crop_before_point(data: list2d, row_num: int, col_num: int) -> list2d:
-    res = []
-    for (i, row) in zip( range(len(data)), data):
-        if i < row_num:
-            continue
-        new_row = []
-        for (j, cell) in zip( range(len(row)), row):
-            if j < col_num:
-                continue
-            new_row.append(cell)
-        res.append(new_row)
-    return res
+    return [row[col_num:] for row in data[row_num:]]
 
 
 def crop_list2d_csv_like(data: list2d) -> list2d:
-    if data == [] or data[0] == []:
+    if not data or not data[0]:
         return data
 
     empty_idx = -1
-    for (i,c) in zip( range(len(data[0])), data[0] ):
-        if c.strip() == '':
-            empty_idx = i
+    for ((txt, _), end) in zip( data[0].runs, data[0].ends ):
+        if txt.strip() == '':
+            empty_idx = end - 1
 
     if empty_idx < 0:
         return data
@@ -193,18 +128,17 @@ def crop_list2d_csv_like(data: list2d) -> list2d:
 
 
 def list2d_to_csv_data(data: list2d, strip_str=False, lower_header=False, dedupe_key=False) -> csv_data:
-    if data == [] or data[0] == []:
+    if not data or not data[0]:
         return []
 
     result = []
-    header = data[0]
+    header = [h.strip() if strip_str else h for h in data[0]]
+    if lower_header:
+        header = [h.lower() for h in header]
     for row in data[1:]:
         rec = {}
-        for (i, r, h) in zip( ints(), row, header ):
-            a = h.strip() if strip_str else h
-            b = r.strip() if strip_str else r
-
-            a = a.lower() if lower_header else a
+        for (i, b, a) in zip( ints(), row, header ):
+            b = b.strip() if strip_str else b
 
             if dedupe_key and a in rec:
                 rec[f'{a}-{i}'] = b
@@ -224,471 +158,62 @@ def str_has_words(text: str, words: str) -> bool:
     return True
 
 
-def sheet_to_csv(sheet: Table, stop_at_empty_row=True) -> csv_data:
+def sheet_to_csv(rows: Iterable[SparseRow], stop_at_empty_row=True) -> csv_data:
     result: list[dict[str, str]] = []
     header: list[str] = []
-    rows = sheet.getElementsByType(TableRow)
 
     for row in rows:
-        vals: list[str] = []
-        cells = row.getElementsByType(TableCell)
-        for cell in cells:
-            rep = get_element_attribute(cell, 'number-columns-repeated')
-            if rep:
-                rep_n = int(rep)
-            else:
-                rep_n = 1
-            s = str(cell)
-            if not header and not s:
-                break
-            for i in range(rep_n):
-                if header and len(vals) >= len(header):
-                    break
-                else:
-                    vals.append(s)
         if not header:
-            header = vals
-        else:
-            if stop_at_empty_row:
-                if all( map(lambda x: x == '', vals) ):
+            for s, rep_n in row.runs:
+                if not s:
                     break
-            rec: dict[str, str] = {}
-            if len(vals) < len(header):
-                vals += [''] * (len(header) - len(vals))
-            assert len(header) == len(vals)
-            for i in range(len(header)):
-                rec[header[i]] = vals[i].strip()
-            result.append(rec)
-
-    return result
-
-
-def doc_to_csv_data(doc: OpenDocumentSpreadsheet, sheet_name: str) -> csv_data:
-    return sheet_to_csv( get_sheet_by_name( doc, sheet_name ) )
-
-
-def doc_parse(doc: OpenDocumentSpreadsheet) -> dict[str, csv_data]:
-    return {
-        'education': doc_to_csv_data(doc, '0. Общая информация'),
-        'course': doc_to_csv_data(doc, '1. Образование'),
-        'seminar': doc_to_csv_data(doc, '2. Семинары'),
-        'project': doc_to_csv_data(doc, '3. Проект-исследование'),
-        'olympiad': doc_to_csv_data(doc, '4. Конкурсы и олимпиады'),
-    }
-
-
-def user_get_or_create(data, ln='Фамилия', fn='Имя', mn='Отчество'):
-    if data['Фамилия'] == 'Райцин':
-        iii = 0
-        pass
-
-    username = make_username(
-        cap_first(data[fn].strip()),
-        cap_first(data[mn].strip()),
-        cap_first(data[ln].strip())
-    )
-
-    user, created = User.objects.get_or_create (
-        # last_name=cap_first( cap_first( data[ln].strip() )),
-        # first_name=cap_first( cap_first( data[fn].strip() )),
-        # middle_name=cap_first( cap_first( data[mn].strip() ))
-        username = username
-    )
-    if created:
-        # old_user = User.objects.filter(username = username)
-        user.username = username
-        user.set_password(generate_password())
-        user.password_clear = generate_password()
-
-    if 'Контактный телефон' in data:
-        user.phone_number = cap_first( data['Контактный телефон'].strip())
-
-    if 'Контактный email' in data:
-        user.email = cap_first( data['Контактный email'].strip())
-
-    user.first_name = cap_first( data[fn].strip())
-    user.middle_name = cap_first( data[mn].strip())
-    user.last_name = cap_first( data[ln].strip())
-
-    user.save()
-
-    return user
-
-
-def department_get_or_create(name):
-    dep = Department.objects.filter(name=name)
-    if not dep:
-        dep = Department(name=name)
-        dep.save()
-    else:
-        dep = dep[0]
-
-    return dep
-
-
-def subject_get_or_create(name):
-    sub = Subject.objects.filter(name=name)
-    if not sub:
-        sub = Subject(name=name)
-        sub.save()
-    else:
-        sub = sub[0]
-
-    return sub
-
-
-def location_get_or_create(name):
-    loc = Location.objects.filter(name=name)
-    if not loc:
-        loc = Location(name=name)
-        loc.save()
-    else:
-        loc = loc[0]
-
-    return loc
-
-
-def sanitize_list_vals(l: list, recurse=True) -> list:
-    if not l:
-        return []
-    else:
-        res = []
-        for x in l:
-            if type(x) is list and recurse:
-                res.append( sanitize_list_vals(x, recurse) )
-            elif type(x) is dict and recurse:
-                res.append(sanitize_dict_vals(x, recurse) )
-            elif x is None:
-                res.append('')
-            else:
-                res.append(x)
-        return res
-
-
-def sanitize_dict_vals(d: dict, recurse=True) -> dict:
-    if not d:
-        return dict()
-    else:
-        res = dict()
-        for k in d:
-            if d[k] is None:
-                res[k] = ""
-            else:
-                if type(d[k]) is dict and recurse:
-                    res[k] = sanitize_dict_vals(d[k], recurse)
-                elif type(d[k]) is list and recurse:
-                    res[k] = sanitize_list_vals(d[k], recurse)
-                else:
-                    res[k] = d[k]
-        return res
-
-
-def import_education(data, strict=True) -> list[Any]:
-    try:
-        student = user_get_or_create(data)
-
-        dep = department_get_or_create(cap_first(data['Площадка'].strip()))
+                header += [s] * rep_n
+            continue
 
-        edu = Education.objects.filter(
-            student__id=student.id,
-            department__id=dep.id,
-            start_date=datetime.strptime(data['Дата поступления'].strip(), "%d.%m.%Y"),
-            start_class=cap_first( data['Класс поступления'].strip()),
-            finish_date=datetime.strptime(data['Дата завершения'].strip(), "%d.%m.%Y"),
-            finish_class=cap_first( data['Класс завершения'].strip())
-        )
-        if not edu:
-            edu = Education(
-                student=student,
-                department=dep,
-                start_date=datetime.strptime(data['Дата поступления'].strip(), "%d.%m.%Y"),
-                start_class=cap_first( data['Класс поступления'].strip()),
-                finish_date=datetime.strptime(data['Дата завершения'].strip(), "%d.%m.%Y"),
-                finish_class=cap_first( data['Класс завершения'].strip())
-            )
-            edu.save()
-        else:
-            edu = edu[0]
+        vals = row[0:len(header)]
+        if stop_at_empty_row:
+            if all( s == '' for s, _ in vals.runs ):
+                break
+        vals.append('', len(header) - len(vals))
+        rec: dict[str, str] = {}
+        for h, v in zip(header, vals):
+            rec[h] = v.strip()
+        result.append(rec)
 
-        return [student, dep, edu]
-    except Exception as e:
-        if strict:
-            raise e
-        else:
-            return []
+    return result
 
 
-def import_course(data, strict=True) -> list[Any]:
+def doc_to_csv_data(doc: OdsDocument, sheet_name: str) -> csv_data:
     try:
-        from datetime import datetime
-
-        # Fields
-        # "Фамилия", "Имя", "Отчество", "Название", "Глава", "Предмет", "Количество часов",
-        # "Начало", "Завершение", "Место проведения", "Оценка/зачёт",
-        # "Фамилия преподавателя", "Имя преподавателя", "Отчество преподавателя"
+        rows = doc.rows(sheet_name)
+    except KeyError:
+        raise DataFormatException(f'Нет листа: {sheet_name}')
+    return sheet_to_csv(rows)
 
-        for key in data:
-            if data[key].strip() == '' and key != 'Оценка/зачёт' and key != 'Глава':
-                if strict:
-                    raise DataFormatException(f'Пустое поле: {key}, строка: {data}')
-                else:
-                    return []
 
-        location_raw = cap_first( data["Место проведения"].strip())
-        subject_raw = cap_first( data["Предмет"].strip())
+# Sheets of the new format by the kind of their rows
+sheet_kinds = {
+    'education': '0. Общая информация',
+    'course': '1. Образование',
+    'seminar': '2. Семинары',
+    'project': '3. Проект-исследование',
+    'olympiad': '4. Конкурсы и олимпиады',
+}
 
-        student = user_get_or_create(data)
-        teacher = user_get_or_create(data, "Фамилия преподавателя", "Имя преподавателя", "Отчество преподавателя")
-        subject = subject_get_or_create(subject_raw)
-        location = location_get_or_create(location_raw)
 
-        course = Course.objects.filter(
-            name=cap_first( data["Название"].strip()),
-            location=location,
-            chapter=cap_first( data["Глава"].strip()),
-            subject=subject
-        )
+def doc_parse(doc: OdsDocument) -> dict[str, csv_data]:
+    return {kind: doc_to_csv_data(doc, sheet_name) for kind, sheet_name in sheet_kinds.items()}
 
-        if not course:
-            course = Course(
-                name=cap_first( data["Название"].strip()),
-                location=location,
-                chapter=cap_first( data["Глава"].strip()),
-                subject=subject
-            )
-            course.save()
-        else:
-            course = course[0]
-
-        cp = CourseParticipation.objects.filter(
-            student=student,
-            started=datetime.strptime(data["Начало"].strip(), "%d.%m.%Y"),
-            finished=datetime.strptime(data["Завершение"].strip(), "%d.%m.%Y"),
-            course=course,
-            hours=int(data["Количество часов"].strip()),
-            teacher=teacher,
-            mark=data["Оценка/зачёт"].strip(),
-            is_exam=data["Экзамен"].strip().lower() == 'да'
-        )
-
-        if not cp:
-            cp = CourseParticipation(
-                student=student,
-                started=datetime.strptime(data["Начало"].strip(), "%d.%m.%Y"),
-                finished=datetime.strptime(data["Завершение"].strip(), "%d.%m.%Y"),
-                course=course,
-                hours=int(data["Количество часов"].strip()),
-                teacher=teacher,
-                mark=data["Оценка/зачёт"].strip(),
-                is_exam=data["Экзамен"].strip().lower() == 'да'
-            )
-            cp.save()
-        else:
-            cp = cp[0]
-
-        return [student, teacher, subject, location, course, cp]
-    except Exception as e:
-        if strict:
-            raise DataFormatException(f'Ошибка импорта: {type(e).__name__}: {e}')
-        else:
-            return []
-
-
-def import_seminar(data, strict=True) -> list[Any]:
-    from datetime import datetime
-
-    # Fields
-    # "Фамилия", "Имя", "Отчество",
-    # "Название семинара", "Предмет", "Количество часов",
-    # "Оценка/зачёт", "Начало", "Завершение", "Место проведения",
-    # "Фамилия преподавателя", "Имя преподавателя", "Отчество преподавателя"
-
-    for key in data:
-        if data[key].strip() == '' and key != 'Оценка/зачёт':
-            if strict:
-                raise DataFormatException(f'Пустое поле: {key}, строка: {data}')
-            else:
-                return []
-
-    location_raw = cap_first(data["Место проведения"].strip())
-    subject_raw = cap_first(data["Предмет"].strip())
-
-    student = user_get_or_create(data)
-    teacher = user_get_or_create(data, "Фамилия преподавателя", "Имя преподавателя", "Отчество преподавателя")
-    subject = subject_get_or_create(subject_raw)
-    location = location_get_or_create(location_raw)
-
-    seminar = Seminar.objects.filter(
-        name=cap_first(data["Название семинара"].strip()),
-        location=location,
-        subject=subject
-    )
-
-    if not seminar:
-        seminar = Seminar(
-            name=cap_first(data["Название семинара"].strip()),
-            location=location,
-            subject=subject
-        )
-        seminar.save()
-    else:
-        seminar = seminar[0]
-
-    sp = SeminarParticipation.objects.filter(
-        student=student,
-        started=datetime.strptime(data["Начало"].strip(), "%d.%m.%Y"),
-        finished=datetime.strptime(data["Завершение"].strip(), "%d.%m.%Y"),
-        seminar=seminar,
-        hours=int(data["Количество часов"].strip()),
-        teacher=teacher,
-        mark=data["Оценка/зачёт"].strip()
-    )
-
-    if not sp:
-        sp = SeminarParticipation(
-            student=student,
-            started=datetime.strptime(data["Начало"].strip(), "%d.%m.%Y"),
-            finished=datetime.strptime(data["Завершение"].strip(), "%d.%m.%Y"),
-            seminar=seminar,
-            hours=int(data["Количество часов"].strip()),
-            teacher=teacher,
-            mark=data["Оценка/зачёт"].strip()
-        )
-        sp.save()
-    else:
-        sp = sp[0]
 
-    return [student, teacher, subject, location, seminar, sp]
+def sanitize_record(rec: record) -> record:
+    # In place, every record is sanitized once on its way to the importer
+    for k, v in rec.items():
+        if v is None:
+            rec[k] = ''
+    return rec
 
 
-def import_project(data, strict=True) -> list[Any]:
-    from datetime import datetime
-
-    # Fields
-    # "Фамилия", "Имя", "Отчество",
-    # "Название проекта", "Место проведения", "Предмет",
-    # "Начало", "Завершение",
-    # "Фамилия руководителя", "Имя руководителя", "Отчество руководителя"
-
-    for key in data:
-        if data[key].strip() == '':
-            if strict:
-                raise DataFormatException(f'Пустое поле: {key}, строка: {data}')
-            else:
-                return []
-
-    location_raw = cap_first(data["Место проведения"].strip())
-    subject_raw = cap_first(data["Предмет"].strip())
-
-    student = user_get_or_create(data)
-    curator = user_get_or_create(data, "Фамилия руководителя", "Имя руководителя", "Отчество руководителя")
-    subject = subject_get_or_create(subject_raw)
-    location = location_get_or_create(location_raw)
-
-    project = Project.objects.filter(
-        name=cap_first(data["Название проекта"].strip()),
-        location=location,
-        subject=subject
-    )
-
-    if not project:
-        project = Project(
-            name=cap_first(data["Название проекта"].strip()),
-            location=location,
-            subject=subject
-        )
-        project.save()
-    else:
-        project = project[0]
-
-    pp = ProjectParticipation.objects.filter(
-        student=student,
-        started=datetime.strptime(data["Начало"].strip(), "%d.%m.%Y"),
-        finished=datetime.strptime(data["Завершение"].strip(), "%d.%m.%Y"),
-        project=project,
-        curator=curator,
-    )
-
-    if not pp:
-        pp = ProjectParticipation(
-            student=student,
-            started=datetime.strptime(data["Начало"].strip(), "%d.%m.%Y"),
-            finished=datetime.strptime(data["Завершение"].strip(), "%d.%m.%Y"),
-            project=project,
-            curator=curator,
-        )
-        pp.save()
-    else:
-        pp = pp[0]
-
-    return [student, curator, subject, location, project, pp]
-
-
-def import_olympiad(data, strict=True):
-    from datetime import datetime
-
-    # Fields
-    # "Фамилия", "Имя", "Отчество",
-    # "Этап", "Название конкурса / олимпиады",
-    # "Начало", "Завершение", "Место проведения",
-    # "Звание", "Награда", "В составе команды"
-
-    for key in data:
-        if data[key].strip() == '' and key not in ['Этап', 'Звание', 'Награда', 'В составе команды']:
-            if strict:
-                raise DataFormatException(f'Пустое поле: {key}, строка: {data}')
-            else:
-                return []
-
-    location_raw = cap_first(data["Место проведения"].strip())
-
-    student = user_get_or_create(data)
-    location = location_get_or_create(location_raw)
-
-    olympiad = Olympiad.objects.filter(
-        name=cap_first(data["Название конкурса / олимпиады"].strip()),
-        location=location,
-        stage=cap_first(data["Этап"].strip()),
-    )
-
-    if not olympiad:
-        olympiad = Olympiad(
-            name=cap_first(data["Название конкурса / олимпиады"].strip()),
-            location=location,
-            stage=cap_first(data["Этап"].strip()),
-        )
-        olympiad.save()
-    else:
-        olympiad = olympiad[0]
-
-    op = OlympiadParticipation.objects.filter(
-        olympiad=olympiad,
-        student=student,
-        started=datetime.strptime(data["Начало"].strip(), "%d.%m.%Y"),
-        finished=datetime.strptime(data["Завершение"].strip(), "%d.%m.%Y"),
-        title=cap_first(data["Звание"].strip()),
-        prize=cap_first(data["Награда"].strip()),
-        is_team_member=data["В составе команды"].strip().upper() == 'ДА'
-    )
-
-    if not op:
-        op = OlympiadParticipation(
-            olympiad=olympiad,
-            student=student,
-            started=datetime.strptime(data["Начало"].strip(), "%d.%m.%Y"),
-            finished=datetime.strptime(data["Завершение"].strip(), "%d.%m.%Y"),
-            title=cap_first(data["Звание"].strip()),
-            prize=cap_first(data["Награда"].strip()),
-            is_team_member=data["В составе команды"].strip().upper() == 'ДА'
-        )
-        op.save()
-    else:
-        op = op[0]
-
-    return [student, location, olympiad, op]
-
-
-def doc_parse_old_and_ugly_format(doc: OpenDocumentSpreadsheet, filename: str = "") -> dict[str, csv_data]:
+def doc_parse_old_and_ugly_format(doc: OdsDocument, filename: str = "") -> dict[str, csv_data]:
     log = logging.getLogger(__name__)
     result = {
         'education': [],
@@ -702,30 +227,28 @@ def doc_parse_old_and_ugly_format(doc: OpenDocumentSpreadsheet, filename: str =
         log.info(f"Started parsing file: {filename}")
 
     # Trying to guess sheet names
-    sheets = doc_get_sheets(doc)
     sheet_map = {}
 
-    for sheet in sheets:
-        n = get_sheet_name(sheet)
+    for n in doc.sheet_names():
         l = n.lower()
         if l == 'ДО (допобразование)'.lower() or l.find('допобразование') >= 0 or n.find('ДО') >= 0:
-            sheet_map['do'] = sheet
+            sheet_map['do'] = n
         elif l == 'Экзамены (сессия)'.lower() or l.find('экзамены') >= 0 or l.find('сессия') >= 0:
-            sheet_map['exams'] = sheet
+            sheet_map['exams'] = n
         elif l == 'Семинары'.lower() or l.find('семинары') >= 0:
-            sheet_map['seminars'] = sheet
+            sheet_map['seminars'] = n
         elif l == 'Проект-исследование'.lower() or l.find('проект') >= 0 or l.find('исследование') >= 0:
-            sheet_map['projects'] = sheet
+            sheet_map['projects'] = n
         elif l == 'Участие в конкурсах и олимп. '.lower() or l.find('участие в конкурсах') >= 0 or l.find('олимп') >= 0:
-            sheet_map['olympiads'] = sheet
+            sheet_map['olympiads'] = n
         elif l == 'Летняя школа '.lower() or l.find('летняя') >= 0:
-            sheet_map['summer'] = sheet
+            sheet_map['summer'] = n
         else:
             pass
 
     log.info(f'By now, we have these mappings ({len(sheet_map)} in total):')
     for k in sheet_map:
-        log.info(f'\t{k} -> \'{get_sheet_name(sheet_map[k])}\'')
+        log.info(f'\t{k} -> \'{sheet_map[k]}\'')
 
     if len(sheet_map) != 6:
         log.info('WARN: Wrong number of sheets found.')
@@ -772,32 +295,32 @@ def doc_parse_old_and_ugly_format(doc: OpenDocumentSpreadsheet, filename: str =
     log.info('OK, continuing...')
 
     try:
-        result['course'] = parse_ugly_do(sheet_map['do'], h)
+        result['course'] = parse_ugly_do(doc.rows(sheet_map['do']), h)
     except Exception as e:
         log.info(f"Failed to parse 'do' from {filename}")
         pass
     try:
-        result['course'] += parse_ugly_exams(sheet_map['exams'], h)
+        result['course'] += parse_ugly_exams(doc.rows(sheet_map['exams']), h)
     except Exception as e:
         log.info(f"Failed to parse 'exams' from {filename}")
         pass
     try:
-        result['course'] += parse_ugly_summer(sheet_map['summer'], h)
+        result['course'] += parse_ugly_summer(doc.rows(sheet_map['summer']), h)
     except Exception as e:
         log.info(f"Failed to parse 'summer' from {filename}")
         pass
     try:
-        result['seminar'] = parse_ugly_seminars(sheet_map['seminars'], h)
+        result['seminar'] = parse_ugly_seminars(doc.rows(sheet_map['seminars']), h)
     except Exception as e:
         log.info(f"Failed to parse 'seminar' from {filename}")
         pass
     try:
-        result['project'] = parse_ugly_projects(sheet_map['projects'], h)
+        result['project'] = parse_ugly_projects(doc.rows(sheet_map['projects']), h)
     except Exception as e:
         log.info(f"Failed to parse 'project' from {filename}")
         pass
     try:
-        result['olympiad'] = parse_ugly_olympiads(sheet_map['olympiads'], h)
+        result['olympiad'] = parse_ugly_olympiads(doc.rows(sheet_map['olympiads']), h)
     except Exception as e:
         log.info(f"Failed to parse 'olympiad' from {filename}")
         pass
@@ -896,9 +419,9 @@ class UglyHelper:
         department = {self.department}"""
 
 
-def parse_ugly_do(sheet: Table, helper: UglyHelper) -> csv_data:
+def parse_ugly_do(rows: Iterable[SparseRow], helper: UglyHelper) -> csv_data:
     log = logging.getLogger(__name__)
-    lst = sheet_to_list2d(sheet)
+    lst = sheet_to_list2d(rows)
     (row, col) = find_fio(lst)
     lst = list2d_crop_before_point(lst, row, col)
     lst = crop_list2d_csv_like(lst)
@@ -952,9 +475,9 @@ def parse_ugly_do(sheet: Table, helper: UglyHelper) -> csv_data:
     return result
 
 
-def parse_ugly_exams(sheet: Table, helper: UglyHelper) -> csv_data:
+def parse_ugly_exams(rows: Iterable[SparseRow], helper: UglyHelper) -> csv_data:
     log = logging.getLogger(__name__)
-    lst = sheet_to_list2d(sheet)
+    lst = sheet_to_list2d(rows)
     (row, col) = find_fio(lst)
     lst = list2d_crop_before_point(lst, row, col)
     lst = crop_list2d_csv_like(lst)
@@ -1008,9 +531,9 @@ def parse_ugly_exams(sheet: Table, helper: UglyHelper) -> csv_data:
     return result
 
 
-def parse_ugly_seminars(sheet: Table, helper: UglyHelper) -> csv_data:
+def parse_ugly_seminars(rows: Iterable[SparseRow], helper: UglyHelper) -> csv_data:
     log = logging.getLogger(__name__)
-    lst = sheet_to_list2d(sheet)
+    lst = sheet_to_list2d(rows)
     (row, col) = find_fio(lst)
     lst = list2d_crop_before_point(lst, row, col)
     lst = crop_list2d_csv_like(lst)
@@ -1066,9 +589,9 @@ def parse_ugly_seminars(sheet: Table, helper: UglyHelper) -> csv_data:
     return result
 
 
-def parse_ugly_projects(sheet: Table, helper: UglyHelper) -> csv_data:
+def parse_ugly_projects(rows: Iterable[SparseRow], helper: UglyHelper) -> csv_data:
     log = logging.getLogger(__name__)
-    lst = sheet_to_list2d(sheet)
+    lst = sheet_to_list2d(rows)
     (row, col) = find_fio(lst)
     lst = list2d_crop_before_point(lst, row, col)
     lst = crop_list2d_csv_like(lst)
@@ -1121,9 +644,9 @@ def parse_ugly_projects(sheet: Table, helper: UglyHelper) -> csv_data:
     return result
 
 
-def parse_ugly_olympiads(sheet: Table, helper: UglyHelper) -> csv_data:
+def parse_ugly_olympiads(rows: Iterable[SparseRow], helper: UglyHelper) -> csv_data:
     log = logging.getLogger(__name__)
-    lst = sheet_to_list2d(sheet)
+    lst = sheet_to_list2d(rows)
     (row, col) = find_fio(lst)
     lst = list2d_crop_before_point(lst, row, col)
     lst = crop_list2d_csv_like(lst)
@@ -1171,9 +694,9 @@ def parse_ugly_olympiads(sheet: Table, helper: UglyHelper) -> csv_data:
     return result
 
 
-def parse_ugly_summer(sheet: Table, helper: UglyHelper) -> csv_data:
+def parse_ugly_summer(rows: Iterable[SparseRow], helper: UglyHelper) -> csv_data:
     log = logging.getLogger(__name__)
-    lst = sheet_to_list2d(sheet)
+    lst = sheet_to_list2d(rows)
     (row, col) = find_fio(lst)
     lst = list2d_crop_before_point(lst, row, col)
     lst = crop_list2d_csv_like(lst)
@@ -1260,21 +783,26 @@ def generate_ugly_educations(results: dict, helper: UglyHelper) -> list[dict]:
     return result
 
 
-def find_fio(data: list[list[str]]) -> (int, int):
+def find_fio(data: list2d) -> (int, int):
     for y in range(len(data)):
         row = data[y]
-        for x in range(len(row)):
-            cell = row[x]
+        # Only the last cell of a run can be followed by a different one
+        for ((cell, _), end) in zip( row.runs, row.ends ):
+            x = end - 1
             if cell.strip().lower() == 'фамилия' and x + 2 < len(row):
                 if row[x+1].strip().lower() == 'имя' and row[x+2].strip().lower() == 'отчество':
                     return (y, x)
 
 
-def stitch_educations(edu_list):
+def education_student(edu: record) -> Tuple[str, str, str]:
+    return edu['Фамилия'], edu['Имя'], edu['Отчество']
+
+
+def stitch_educations(edu_list: Iterable[record]) -> list[record]:
     index = {}
     result = []
     for edu in edu_list:
-        add_to_dict_multival(index, (edu['Фамилия'], edu['Имя'], edu['Отчество'] ), edu)
+        add_to_dict_multival(index, education_student(edu), edu)
 
     for fio in index:
         edus_new = []
@@ -1303,10 +831,57 @@ def stitch_educations(edu_list):
     return result
 
 
-def find_files(root_dir: str) -> list[str]:
+def route_records(parsed: Iterable[dict[str, csv_data]]) -> Iterator[Tuple[str, record]]:
+    # Yields (kind, record) for the rows of the parsed files as they come. Educations are
+    # the only rows held back, by student: the ones of a student are stitched across all
+    # the files. The rows of the other sheets are not kept.
+    educations: dict[Tuple[str, str, str], list[record]] = {}
+    for data in parsed:
+        for kind, records in data.items():
+            for rec in records:
+                sanitize_record(rec)
+                if kind == 'education':
+                    add_to_dict_multival(educations, education_student(rec), rec)
+                else:
+                    yield kind, rec
+            records.clear()
+    for student_educations in educations.values():
+        for rec in stitch_educations(student_educations):
+            yield 'education', rec
+
+
+def find_files(root_dir: str) -> list[pathlib.Path]:
     result = []
     for root, dirs, files in os.walk(root_dir):
         for f in files:
             p = pathlib.Path(root, f)
             result.append(p)
-    return result
\ No newline at end of file
+    return result
+
+
+def parse_file(content: bytes, filename: str, use_old_format: bool = False) -> dict[str, csv_data]:
+    if use_old_format:
+        return doc_parse_old_and_ugly_format(OdsDocument(io.BytesIO(content)), filename=filename)
+    return doc_parse(OdsDocument(io.BytesIO(content)))
+
+
+def parse_files(files: Iterable[Tuple[str, bytes]], use_old_format: bool = False,
+                workers: int = 1) -> Iterator[dict[str, csv_data]]:
+    # Parsing needs no database, so the files are parsed in worker processes and only
+    # the records (plain dicts) come back, in the order of the files. At most `workers`
+    # parsed files wait for the consumer (pool.map would submit and buffer all of them).
+    files = list(files)
+    if workers <= 1 or len(files) <= 1:
+        for name, content in files:
+            yield parse_file(content, name, use_old_format)
+        return
+
+    workers = min(workers, len(files))
+    with process_pool(workers) as pool:
+        pending = deque()
+        for name, content in files:
+            if len(pending) == workers:
+                yield pending.popleft().result()
+            pending.append(pool.submit(parse_file, content, name, use_old_format))
+        while pending:
+            yield pending.popleft().result()
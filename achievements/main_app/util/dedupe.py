@@ -0,0 +1,67 @@
+# Merges repeated and consecutive educations of a student at the same department
+from typing import Iterable, Iterator
+
+from django.db import transaction
+
+from ..models import Education
+from .similarity_index import update_similarity_index_for_model
+from .util import chunks
+
+BULK_BATCH_SIZE = 1000
+IN_CHUNK_SIZE = 1000
+
+
+def education_rows(student_ids: Iterable[int] = None) -> Iterator[dict]:
+    rows = Education.objects \
+        .order_by('student_id', 'start_date', 'id') \
+        .values('id', 'student_id', 'department_id', 'start_date', 'finish_date')
+    if student_ids is None:
+        yield from rows.iterator()
+        return
+    # Chunks of sorted ids keep the rows ordered by student
+    for chunk in chunks(sorted(set(student_ids)), IN_CHUNK_SIZE):
+        yield from rows.filter(student_id__in=chunk)
+
+
+def plan_edu_dedupe(student_ids: Iterable[int] = None) -> tuple[dict[int, dict], list[int]]:
+    # One ordered pass: returns the changed heads (id -> new dates) and the ids to delete
+    updates: dict[int, dict] = {}
+    deleted: list[int] = []
+
+    head = None
+    for edu in education_rows(student_ids):
+        if head is None or head['student_id'] != edu['student_id'] \
+                or head['department_id'] != edu['department_id']:
+            head = edu
+            continue
+
+        start_date = min(head['start_date'], edu['start_date'])
+        finish_date = max(head['finish_date'], edu['finish_date'])
+        if (start_date, finish_date) != (head['start_date'], head['finish_date']):
+            head['start_date'] = start_date
+            head['finish_date'] = finish_date
+            updates[head['id']] = {'start_date': start_date, 'finish_date': finish_date}
+        deleted.append(edu['id'])
+
+    return updates, deleted
+
+
+def dedupe_educations(dry_run: bool = False, student_ids: Iterable[int] = None) -> dict[str, int]:
+    # Only the educations of the given students when there are some, all of them otherwise
+    with transaction.atomic():
+        updates, deleted = plan_edu_dedupe(student_ids)
+
+        if not dry_run:
+            # Deleted first, a widened head may equal one of them (unique_education)
+            for chunk in chunks(deleted, IN_CHUNK_SIZE):
+                Education.objects.filter(id__in=chunk).delete()
+            heads = [Education(id=id, **dates) for id, dates in updates.items()]
+            Education.objects.bulk_update(heads, ['start_date', 'finish_date'], batch_size=BULK_BATCH_SIZE)
+
+    if not dry_run:
+        update_similarity_index_for_model(Education, list(updates) + deleted)
+
+    return {
+        'updated': len(updates),
+        'deleted': len(deleted),
+    }
@@ -0,0 +1,123 @@
+# Merges duplicate objects: every reference to the victims is moved to the survivor
+# with one UPDATE per referencing column, then the victims are deleted
+from typing import Iterable
+
+from django.db import models, transaction
+
+from ..models import Participation
+from .dashboard import invalidate_dashboard_stats
+from .natural_keys import refresh_natural_keys
+from .similarity import obj_type_projection_map
+from .similarity_index import similarity_obj_types_for_model, update_similarity_index_for_model
+
+
+class MergeException(Exception):
+    pass
+
+
+def referencing_fields(model: type) -> list[models.ForeignKey]:
+    # Foreign keys pointing to the model or its parents (found in the model metadata, so
+    # M2M through tables and models of other apps are included), except the links of
+    # multi-table inheritance, which share the primary key
+    fields = []
+    for m in [model] + model._meta.get_parent_list():
+        for rel in m._meta.get_fields(include_hidden=True):
+            if not rel.auto_created or rel.concrete or rel.many_to_many:
+                continue
+            if rel.one_to_one and rel.parent_link:
+                continue
+            fields.append(rel.field)
+    return fields
+
+
+def unique_field_sets(model: type, field: models.ForeignKey) -> list[list[str]]:
+    # Column sets which must stay unique and contain the field
+    sets = [list(u) for u in model._meta.unique_together]
+    sets += [list(c.fields) for c in model._meta.total_unique_constraints]
+    if field.unique:
+        sets.append([field.name])
+
+    return [
+        [model._meta.get_field(name).attname for name in s]
+        for s in sets
+        if field.name in s
+    ]
+
+
+def repoint_references(field: models.ForeignKey, survivor_id: int, victim_ids: list[int]) -> int:
+    model = field.model
+    qs = model._base_manager.all()
+    victims_qs = qs.filter(**{f'{field.attname}__in': victim_ids})
+
+    # Rows which would duplicate a row of the survivor (e.g. the same department linked
+    # to a course twice) are dropped instead of being moved
+    dropped = set()
+    survivor_qs = qs.filter(**{field.attname: survivor_id})
+    for columns in unique_field_sets(model, field):
+        others = [c for c in columns if c != field.attname]
+        if others:
+            seen = set(survivor_qs.values_list(*others))
+        else:
+            seen = {()} if survivor_qs.exists() else set()
+        for pk, *key in victims_qs.order_by('pk').values_list('pk', *others):
+            key = tuple(key)
+            if key in seen:
+                dropped.add(pk)
+            else:
+                seen.add(key)
+
+    if dropped:
+        qs.filter(pk__in=dropped).delete()
+
+    return victims_qs.update(**{field.attname: survivor_id})
+
+
+def merge_objects(obj_type: str, survivor_id: int, victim_ids: Iterable[int]) -> dict[str, int]:
+    if obj_type not in obj_type_projection_map:
+        raise MergeException(f'Bad object type: {obj_type}')
+
+    model = obj_type_projection_map[obj_type][0]
+    victim_ids = sorted(set(victim_ids) - {survivor_id})
+    if not victim_ids:
+        raise MergeException('Nothing to merge')
+
+    fields = referencing_fields(model)
+    indexed = {f: similarity_obj_types_for_model(f.model) for f in fields}
+
+    with transaction.atomic():
+        if model.objects.filter(pk__in=[survivor_id] + victim_ids).count() != len(victim_ids) + 1:
+            raise MergeException('Some of the objects do not exist')
+
+        moved = 0
+        moved_ids: dict[type, list[int]] = {}  # text representations of these may change
+        rekeyed_ids: dict[type, list[int]] = {}  # natural keys of these change
+        for f in fields:
+            keyed = issubclass(f.model, Participation)
+            if indexed[f] or keyed:
+                ids = list(
+                    f.model._base_manager
+                        .filter(**{f'{f.attname}__in': victim_ids})
+                        .values_list('pk', flat=True)
+                )
+                if indexed[f]:
+                    moved_ids.setdefault(f.model, []).extend(ids)
+                if keyed:
+                    rekeyed_ids.setdefault(f.model, []).extend(ids)
+            moved += repoint_references(f, survivor_id, victim_ids)
+
+        # Participations which became the same as the survivor's are dropped
+        for m, ids in rekeyed_ids.items():
+            refresh_natural_keys(m, ids, drop_duplicates=True)
+
+        deleted, _ = model.objects.filter(pk__in=victim_ids).delete()
+
+    for m, ids in moved_ids.items():
+        update_similarity_index_for_model(m, ids)
+    update_similarity_index_for_model(model, victim_ids)
+    invalidate_dashboard_stats()
+
+    return {
+        'merged': len(victim_ids),
+        'moved': moved,
+        'deleted': deleted,
+    }
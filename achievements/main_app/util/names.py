@@ -0,0 +1,64 @@
+# Dictionaries of known first names (with gender) and surnames. They are parsed once
+# per process on first use, the strings are interned to keep them compact.
+import json
+import os
+import sys
+from functools import lru_cache
+from typing import Optional
+
+from django.conf import settings
+
+RU_NAMES_FILE = 'main_app/static/russian_names.json'
+FOREIGN_NAMES_FILE = 'main_app/static/foreign_names.json'
+RU_SURNAMES_FILE = 'main_app/static/russian_surnames.json'
+
+
+def load_json(path: str):
+    with open(os.path.join(settings.BASE_DIR, path), 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def name_genders() -> tuple[frozenset[str], frozenset[str]]:
+    # Returns (male names, female names), later files override earlier ones
+    name_gender = {}
+    for path in [RU_NAMES_FILE, FOREIGN_NAMES_FILE]:
+        for o in load_json(path):
+            if 'Sex' in o:
+                gender = 'M' if o['Sex'] == 'М' else 'F'  # Those are different 'M' letters (en and ru)
+            elif 'gender' in o:
+                gender = 'M' if o['gender'] == 'Male' else 'F'
+            else:
+                continue
+
+            if 'Name' in o:
+                name = str(o['Name'])
+            elif 'name' in o:
+                name = str(o['name'])
+            else:
+                continue
+
+            name_gender[sys.intern(name.capitalize())] = gender
+
+    return (
+        frozenset(n for n, g in name_gender.items() if g == 'M'),
+        frozenset(n for n, g in name_gender.items() if g == 'F'),
+    )
+
+
+@lru_cache(maxsize=None)
+def known_surnames() -> frozenset[str]:
+    return frozenset(
+        sys.intern(str(o['Surname']).capitalize())
+        for o in load_json(RU_SURNAMES_FILE)
+        if 'Surname' in o
+    )
+
+
+def gender_by_name(first_name: str) -> Optional[str]:
+    male, female = name_genders()
+    if first_name in male:
+        return 'M'
+    if first_name in female:
+        return 'F'
+    return None
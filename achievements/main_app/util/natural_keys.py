@@ -0,0 +1,87 @@
+# Participations keep their fields in two tables (multi-table inheritance), so their
+# natural keys can not be a unique constraint over columns. A digest of the key is stored
+# in the unique Participation.natural_key column instead.
+import hashlib
+from typing import Any, Iterable
+
+from django.db import models
+
+from .util import chunks
+
+IN_CHUNK_SIZE = 1000
+BULK_BATCH_SIZE = 1000
+
+# By model name, so the migrations can use them with the historical models
+participation_natural_key_fields: dict[str, list[str]] = {
+    'CourseParticipation': ['student', 'course', 'started', 'finished', 'hours', 'teacher', 'mark', 'is_exam'],
+    'SeminarParticipation': ['student', 'seminar', 'started', 'finished', 'hours', 'teacher', 'mark'],
+    'ProjectParticipation': ['student', 'project', 'started', 'finished', 'curator'],
+    'OlympiadParticipation': ['student', 'olympiad', 'started', 'finished', 'title', 'prize', 'is_team_member'],
+}
+
+
+def natural_key_digest(model_name: str, values: Iterable[Any]) -> str:
+    # Values are the database ones (ids for foreign keys)
+    return hashlib.sha256(repr((model_name, tuple(values))).encode()).hexdigest()
+
+
+def compute_natural_key(obj: models.Model) -> str:
+    name = type(obj).__name__
+    if name not in participation_natural_key_fields:
+        return None
+    fields = participation_natural_key_fields[name]
+    return natural_key_digest(name, [getattr(obj, obj._meta.get_field(f).attname) for f in fields])
+
+
+def refresh_natural_keys(model: type, ids: Iterable[int], drop_duplicates: bool = False) -> int:
+    # Natural keys contain foreign keys, so they change when the referenced objects are
+    # merged or the rows are edited in bulk. With drop_duplicates the rows which became
+    # duplicates are deleted (the oldest one is kept), otherwise they raise IntegrityError.
+    ids = sorted(set(ids))
+    if not ids:
+        return 0
+    if model.__name__ not in participation_natural_key_fields:
+        # Participation itself: the rows are refreshed through their concrete models
+        return sum(
+            refresh_natural_keys(m, ids, drop_duplicates)
+            for m in model.__subclasses__()
+            if m.__name__ in participation_natural_key_fields
+        )
+
+    base = model._meta.get_field('natural_key').model
+    objs = []
+    for chunk in chunks(ids, IN_CHUNK_SIZE):
+        objs += model._base_manager.filter(pk__in=chunk).order_by('pk')
+    for o in objs:
+        o.natural_key = compute_natural_key(o)
+
+    dropped = []
+    if drop_duplicates:
+        taken = set()
+        for chunk in chunks([o.natural_key for o in objs], IN_CHUNK_SIZE):
+            taken.update(
+                base._base_manager
+                    .filter(natural_key__in=chunk)
+                    .exclude(pk__in=ids)
+                    .values_list('natural_key', flat=True)
+            )
+        kept = []
+        for o in objs:
+            if o.natural_key in taken:
+                dropped.append(o.pk)
+            else:
+                taken.add(o.natural_key)
+                kept.append(o)
+        objs = kept
+        for chunk in chunks(dropped, IN_CHUNK_SIZE):
+            model._base_manager.filter(pk__in=chunk).delete()
+
+    # Cleared first, so keys moving between the rows do not collide halfway through
+    for chunk in chunks([o.pk for o in objs], IN_CHUNK_SIZE):
+        base._base_manager.filter(pk__in=chunk).update(natural_key=None)
+    base._base_manager.bulk_update(
+        [base(pk=o.pk, natural_key=o.natural_key) for o in objs],
+        ['natural_key'],
+        batch_size=BULK_BATCH_SIZE
+    )
+    return len(dropped)
@@ -0,0 +1,168 @@
+# Streaming reader of ODS spreadsheets: content.xml is iterparsed straight from the zip,
+# so no DOM of the whole workbook is built. Rows are kept as runs of repeated cells.
+import zipfile
+from bisect import bisect_right
+from itertools import repeat
+from typing import IO, Any, Iterable, Iterator, Optional, Tuple, Union
+from xml.etree.ElementTree import iterparse
+
+TABLE_NS = 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'
+TABLE = f'{{{TABLE_NS}}}table'
+TABLE_ROW = f'{{{TABLE_NS}}}table-row'
+TABLE_CELL = f'{{{TABLE_NS}}}table-cell'
+TABLE_NAME = f'{{{TABLE_NS}}}name'
+COLUMNS_REPEATED = f'{{{TABLE_NS}}}number-columns-repeated'
+ROWS_REPEATED = f'{{{TABLE_NS}}}number-rows-repeated'
+
+
+class SparseRow:
+    # Cells are stored as (text, count) runs, so the ~1000 repeated empty cells
+    # LibreOffice writes at the end of every row take one run
+    __slots__ = ('runs', 'ends')
+
+    def __init__(self, runs: Iterable[Tuple[str, int]] = ()):
+        self.runs: list[Tuple[str, int]] = []
+        self.ends: list[int] = []  # Index past the last cell of each run
+        for text, count in runs:
+            self.append(text, count)
+
+    def append(self, text: str, count: int = 1):
+        if count <= 0:
+            return
+        end = len(self) + count
+        if self.runs and self.runs[-1][0] == text:
+            self.runs[-1] = (text, self.runs[-1][1] + count)
+            self.ends[-1] = end
+        else:
+            self.runs.append((text, count))
+            self.ends.append(end)
+
+    def __len__(self) -> int:
+        return self.ends[-1] if self.ends else 0
+
+    def __iter__(self) -> Iterator[str]:
+        for text, count in self.runs:
+            yield from repeat(text, count)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, 'SparseRow']:
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError('Only contiguous slices are supported')
+            return self.slice(start, stop)
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.runs[bisect_right(self.ends, i)][0]
+
+    def slice(self, start: int, stop: int) -> 'SparseRow':
+        res = SparseRow()
+        k = bisect_right(self.ends, start)
+        while k < len(self.runs) and start < stop:
+            res.append(self.runs[k][0], min(self.ends[k], stop) - start)
+            start = self.ends[k]
+            k += 1
+        return res
+
+    def __repr__(self) -> str:
+        return f'SparseRow({self.runs!r})'
+
+
+class OdsDocument:
+    # Rows are read straight from content.xml as their elements close, nothing but the
+    # sheet names is kept. One pass serves the sheets read in document order, going back
+    # to a sheet the pass went by starts a new one.
+    def __init__(self, file: Union[str, IO[bytes]]):
+        self.zip = zipfile.ZipFile(file)
+        self._elements: Optional[Iterator[Tuple[Optional[str], Any]]] = None  # the current pass
+        self._passed: list[str] = []  # sheets the current pass went by
+        self._next: Optional[str] = None  # sheet whose start the current pass stopped at
+        self._reader = None  # token of the rows() generator reading the current pass
+        self._sheet_names: Optional[list[str]] = None
+
+    def iterparse(self, events):
+        with self.zip.open('content.xml') as f:
+            yield from iterparse(f, events)
+
+    def elements(self) -> Iterator[Tuple[Optional[str], Any]]:
+        # (sheet name, None) when a sheet starts, (None, row element) when a row ends
+        path = []  # open elements, rows are dropped from their parents once read
+        for event, elem in self.iterparse(('start', 'end')):
+            if event == 'start':
+                path.append(elem)
+                if elem.tag == TABLE:
+                    yield elem.get(TABLE_NAME), None
+                continue
+
+            path.pop()
+            if elem.tag == TABLE_ROW:
+                yield None, elem
+                if path:
+                    path[-1].remove(elem)
+            elif elem.tag == TABLE:
+                elem.clear()
+
+    def end_pass(self):
+        self._sheet_names = self._passed
+        self._elements = None
+        self._reader = None
+
+    def seek(self, sheet_name: Optional[str]) -> bool:
+        # Moves the current pass to the start of the sheet, with None to the end
+        if self._elements is not None and self._next is not None and self._next == sheet_name:
+            self._next = None
+            return True
+        if self._elements is None or sheet_name in self._passed:
+            self._elements = self.elements()
+            self._passed = []
+        self._next = None
+        self._reader = None
+
+        for name, _ in self._elements:
+            if name is not None:
+                self._passed.append(name)
+                if name == sheet_name:
+                    return True
+        self.end_pass()
+        return False
+
+    def sheet_names(self) -> list[str]:
+        if self._sheet_names is None:
+            self.seek(None)
+        return self._sheet_names
+
+    def rows(self, sheet_name: str) -> Iterator[SparseRow]:
+        # The rows of the sheet as they are parsed, they can be read until the next call.
+        # KeyError for the sheets not in the document.
+        if self._sheet_names is not None and sheet_name not in self._sheet_names:
+            raise KeyError(sheet_name)
+        if not self.seek(sheet_name):
+            raise KeyError(sheet_name)
+        self._reader = reader = object()
+        return self.read_rows(reader)
+
+    def read_rows(self, reader: object) -> Iterator[SparseRow]:
+        elements = self._elements
+        while self._reader is reader:
+            name, elem = next(elements, (None, None))
+            if name is None and elem is None:
+                self.end_pass()
+                return
+            if name is not None:
+                # The next sheet starts, the pass stops there
+                self._passed.append(name)
+                self._next = name
+                self._reader = None
+                return
+
+            row = SparseRow(
+                (''.join(cell.itertext()), int(cell.get(COLUMNS_REPEATED, 1)))
+                for cell in elem.iter(TABLE_CELL)
+            )
+            # Repeated empty rows (thousands of them at the end of a sheet) come once
+            n = int(elem.get(ROWS_REPEATED, 1))
+            if all(text == '' for text, _ in row.runs):
+                n = 1
+            yield from repeat(row, n)
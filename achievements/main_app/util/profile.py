@@ -0,0 +1,77 @@
+# Loads everything the student profile page shows in a fixed number of queries
+from typing import Optional, Any
+
+from ..models import *
+
+SUMMER_SCHOOL_LOCATION = 'Летняя школа'
+
+
+def load_student_profile(id: int) -> Optional[dict[str, Any]]:
+    user = User.objects.filter(id=id).first()
+    if not user:
+        return None
+
+    if user.gender == 'M':
+        user.gender_print = 'Мужской'
+    elif user.gender == 'F':
+        user.gender_print = 'Женский'
+    else:
+        user.gender_print = 'Не указан'
+
+    edu = list(
+        Education.objects
+        .filter(student__id=id)
+        .select_related('department')
+        .order_by('start_date', 'id')
+    )
+
+    # Courses and exams share a table, so they are fetched together and split here
+    cp = []
+    ex = []
+    summer_dates = set()
+    course_participations = CourseParticipation.objects \
+        .filter(student__id=id) \
+        .select_related('course__location', 'course__subject', 'teacher') \
+        .order_by('id')
+    for p in course_participations:
+        if p.is_exam:
+            ex.append(p)
+        else:
+            cp.append(p)
+
+        if p.course.location.name == SUMMER_SCHOOL_LOCATION and p.started:
+            summer_dates.add(p.started)
+
+    sp = list(
+        SeminarParticipation.objects
+        .filter(student__id=id)
+        .select_related('seminar__location', 'seminar__subject', 'teacher')
+        .order_by('id')
+    )
+    pp = list(
+        ProjectParticipation.objects
+        .filter(student__id=id)
+        .select_related('project__location', 'project__subject', 'curator')
+        .order_by('id')
+    )
+    op = list(
+        OlympiadParticipation.objects
+        .filter(student__id=id)
+        .select_related('olympiad__location')
+        .order_by('id')
+    )
+
+    latest_edu = max(edu, key=lambda e: e.finish_date, default=None)
+    user.education_department = latest_edu.department if latest_edu else "(нет)"
+
+    return {
+        'id': id,
+        'user': user,
+        'educations': edu,
+        'course_participations': cp,
+        'exam_participations': ex,
+        'seminar_participations': sp,
+        'project_participations': pp,
+        'olympiad_participations': op,
+        'summer_dates': sorted(summer_dates),
+    }
@@ -0,0 +1,19 @@
+# Progress of long running tasks, polled by the tasks page. It goes through the shared
+# cache (settings.CACHES), since the polls may be served by another process than the task
+from typing import Optional
+
+from django.core.cache import cache
+
+TASK_PROGRESS_TTL = 60 * 60
+
+
+def task_progress_key(task_id: str) -> str:
+    return f'main_app:task_progress:{task_id}'
+
+
+def set_task_progress(task_id: str, done: int, total: int):
+    cache.set(task_progress_key(task_id), {'done': done, 'total': total}, TASK_PROGRESS_TTL)
+
+
+def get_task_progress(task_id: str) -> Optional[dict[str, int]]:
+    return cache.get(task_progress_key(task_id))
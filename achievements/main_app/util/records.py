@@ -0,0 +1,140 @@
+# Typed rows of the import sheets, one class per sheet kind. A record is built once per
+# row: the cells are looked up by their headers, stripped and capitalized, and the dates
+# parsed, so the importers work with plain attributes from then on.
+from datetime import datetime, date
+from typing import Iterable
+
+from .data_import import DataFormatException, cap_first, make_username, record
+
+
+def parse_date(s: str) -> date:
+    return datetime.strptime(s.strip(), "%d.%m.%Y").date()
+
+
+def parse_datetime(s: str) -> datetime:
+    return datetime.strptime(s.strip(), "%d.%m.%Y")
+
+
+def check_empty_fields(data: record, allowed_empty: Iterable[str] = ()):
+    for key in data:
+        if data[key].strip() == '' and key not in allowed_empty:
+            raise DataFormatException(f'Пустое поле: {key}, строка: {data}')
+
+
+class Record:
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{s}={getattr(self, s)!r}' for s in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class Person(Record):
+    __slots__ = ('username', 'first_name', 'middle_name', 'last_name', 'phone_number', 'email')
+
+    def __init__(self, data: record, ln='Фамилия', fn='Имя', mn='Отчество'):
+        self.first_name = cap_first(data[fn].strip())
+        self.middle_name = cap_first(data[mn].strip())
+        self.last_name = cap_first(data[ln].strip())
+        # None when the sheet has no such column, so the stored value is kept
+        self.phone_number = cap_first(data['Контактный телефон'].strip()) if 'Контактный телефон' in data else None
+        self.email = cap_first(data['Контактный email'].strip()) if 'Контактный email' in data else None
+        self.username = make_username(self.first_name, self.middle_name, self.last_name)
+
+    def fields(self) -> dict[str, str]:
+        res = {'first_name': self.first_name, 'middle_name': self.middle_name, 'last_name': self.last_name}
+        if self.phone_number is not None:
+            res['phone_number'] = self.phone_number
+        if self.email is not None:
+            res['email'] = self.email
+        return res
+
+
+def teacher(data: record) -> Person:
+    return Person(data, 'Фамилия преподавателя', 'Имя преподавателя', 'Отчество преподавателя')
+
+
+class EducationRecord(Record):
+    __slots__ = ('student', 'department', 'start_date', 'start_class', 'finish_date', 'finish_class')
+
+    def __init__(self, data: record):
+        self.student = Person(data)
+        self.department = cap_first(data['Площадка'].strip())
+        self.start_date = parse_date(data['Дата поступления'])
+        self.start_class = cap_first(data['Класс поступления'].strip())
+        self.finish_date = parse_date(data['Дата завершения'])
+        self.finish_class = cap_first(data['Класс завершения'].strip())
+
+
+class CourseRecord(Record):
+    __slots__ = ('student', 'teacher', 'name', 'location', 'chapter', 'subject', 'started', 'finished', 'hours',
+                 'mark', 'is_exam')
+
+    def __init__(self, data: record):
+        check_empty_fields(data, ['Оценка/зачёт', 'Глава'])
+        self.location = cap_first(data["Место проведения"].strip())
+        self.subject = cap_first(data["Предмет"].strip())
+        self.student = Person(data)
+        self.teacher = teacher(data)
+        self.name = cap_first(data["Название"].strip())
+        self.chapter = cap_first(data["Глава"].strip())
+        self.started = parse_datetime(data["Начало"])
+        self.finished = parse_datetime(data["Завершение"])
+        self.hours = int(data["Количество часов"].strip())
+        self.mark = data["Оценка/зачёт"].strip()
+        self.is_exam = data["Экзамен"].strip().lower() == 'да'
+
+
+class SeminarRecord(Record):
+    __slots__ = ('student', 'teacher', 'name', 'location', 'subject', 'started', 'finished', 'hours', 'mark')
+
+    def __init__(self, data: record):
+        check_empty_fields(data, ['Оценка/зачёт'])
+        self.location = cap_first(data["Место проведения"].strip())
+        self.subject = cap_first(data["Предмет"].strip())
+        self.student = Person(data)
+        self.teacher = teacher(data)
+        self.name = cap_first(data["Название семинара"].strip())
+        self.started = parse_datetime(data["Начало"])
+        self.finished = parse_datetime(data["Завершение"])
+        self.hours = int(data["Количество часов"].strip())
+        self.mark = data["Оценка/зачёт"].strip()
+
+
+class ProjectRecord(Record):
+    __slots__ = ('student', 'curator', 'name', 'location', 'subject', 'started', 'finished')
+
+    def __init__(self, data: record):
+        check_empty_fields(data)
+        self.location = cap_first(data["Место проведения"].strip())
+        self.subject = cap_first(data["Предмет"].strip())
+        self.student = Person(data)
+        self.curator = Person(data, "Фамилия руководителя", "Имя руководителя", "Отчество руководителя")
+        self.name = cap_first(data["Название проекта"].strip())
+        self.started = parse_datetime(data["Начало"])
+        self.finished = parse_datetime(data["Завершение"])
+
+
+class OlympiadRecord(Record):
+    __slots__ = ('student', 'name', 'location', 'stage', 'started', 'finished', 'title', 'prize', 'is_team_member')
+
+    def __init__(self, data: record):
+        check_empty_fields(data, ['Этап', 'Звание', 'Награда', 'В составе команды'])
+        self.location = cap_first(data["Место проведения"].strip())
+        self.student = Person(data)
+        self.name = cap_first(data["Название конкурса / олимпиады"].strip())
+        self.stage = cap_first(data["Этап"].strip())
+        self.started = parse_datetime(data["Начало"])
+        self.finished = parse_datetime(data["Завершение"])
+        self.title = cap_first(data["Звание"].strip())
+        self.prize = cap_first(data["Награда"].strip())
+        self.is_team_member = data["В составе команды"].strip().upper() == 'ДА'
+
+
+record_types: dict[str, type] = {
+    'education': EducationRecord,
+    'course': CourseRecord,
+    'seminar': SeminarRecord,
+    'project': ProjectRecord,
+    'olympiad': OlympiadRecord,
+}
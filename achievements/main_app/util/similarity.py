@@ -0,0 +1,445 @@
+# Fuzzy search for similar (possibly duplicate) objects
+import heapq
+import re
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from ctypes import ArgumentError
+from itertools import islice
+from typing import Callable, Tuple, Any, Iterable
+
+from django.db import models
+from fuzzywuzzy import fuzz
+from fuzzywuzzy import utils as fuzz_utils
+
+from ..models import *
+from .util import add_to_dict_multival, process_pool
+
+cmp_func_map: dict[str, Callable[[str, str], int]] = {
+    'ratio':                    fuzz.ratio,
+    'partial_ratio':            fuzz.partial_ratio,
+    'UQRatio':                  fuzz.UQRatio,
+    'QRatio':                   fuzz.QRatio,
+    'partial_token_set_ratio':  fuzz.partial_token_set_ratio,
+    'partial_token_sort_ratio': fuzz.partial_token_sort_ratio,
+    'token_set_ratio':          fuzz.token_set_ratio,
+    'token_sort_ratio':         fuzz.token_sort_ratio,
+    'UWRatio':                  fuzz.UWRatio,
+    'WRatio':                   fuzz.WRatio,
+}
+
+
+def full_name_str(last_name, first_name, middle_name) -> str:
+    return f"{last_name} {first_name} {middle_name}"
+
+
+# Projections: for every object type the model, the minimal set of columns (joins are
+# done by the database) and a function building the same string as the model's __str__
+# from them. This lets the search stream (id, string) tuples without creating models.
+obj_type_projection_map: dict[str, Tuple[type, list[str], Callable[..., str]]] = {
+    'user': (
+        User,
+        ['last_name', 'first_name', 'middle_name'],
+        full_name_str
+    ),
+    'location': (Location, ['name'], lambda name: name),
+    'department': (Department, ['name'], lambda name: name),
+    'education': (
+        Education,
+        ['student__last_name', 'student__first_name', 'student__middle_name', 'start_date', 'finish_date'],
+        lambda ln, fn, mn, start, finish: f"{full_name_str(ln, fn, mn)} ({start.year}-{finish.year})"
+    ),
+    'subject': (Subject, ['name'], lambda name: name),
+    'activity': (
+        Activity,
+        ['name', 'location__name'],
+        lambda name, location: adv_join(', ', [name, location])
+    ),
+    'course': (
+        Course,
+        ['name', 'location__name', 'chapter'],
+        lambda name, location, chapter: adv_join(', ', [name, location, chapter])
+    ),
+    'seminar': (
+        Seminar,
+        ['name', 'location__name', 'subject__name'],
+        lambda name, location, subject: adv_join(', ', [name, location, subject])
+    ),
+    'project': (
+        Project,
+        ['name', 'location__name', 'subject__name'],
+        lambda name, location, subject: adv_join(', ', [name, location, subject])
+    ),
+    'olympiad': (
+        Olympiad,
+        ['name', 'location__name', 'stage'],
+        lambda name, location, stage: adv_join(', ', [name, location, stage])
+    ),
+    # Award is abstract, its only concrete table is the olympiad participation one
+    'award': (
+        OlympiadParticipation,
+        ['title', 'prize', 'is_team_member'],
+        lambda title, prize, team: adv_join(', ', [title, prize, 'в составе команды' if team else None])
+    ),
+    'participation': (
+        Participation,
+        ['student__last_name', 'student__first_name', 'student__middle_name', 'started', 'finished'],
+        lambda ln, fn, mn, started, finished: f"{full_name_str(ln, fn, mn)} ({started} - {finished})"
+    ),
+    'courseparticipation': (
+        CourseParticipation,
+        ['student__last_name', 'student__first_name', 'student__middle_name',
+         'course__name', 'course__location__name', 'course__chapter'],
+        lambda ln, fn, mn, name, location, chapter:
+            f"{full_name_str(ln, fn, mn)}, {adv_join(', ', [name, location, chapter])}"
+    ),
+    'seminarparticipation': (
+        SeminarParticipation,
+        ['student__last_name', 'student__first_name', 'student__middle_name',
+         'seminar__name', 'seminar__location__name', 'seminar__subject__name'],
+        lambda ln, fn, mn, name, location, subject:
+            f"{full_name_str(ln, fn, mn)}, {adv_join(', ', [name, location, subject])}"
+    ),
+    'projectparticipation': (
+        ProjectParticipation,
+        ['student__last_name', 'student__first_name', 'student__middle_name',
+         'project__name', 'project__location__name', 'project__subject__name'],
+        lambda ln, fn, mn, name, location, subject:
+            f"{full_name_str(ln, fn, mn)}, {adv_join(', ', [name, location, subject])}"
+    ),
+    'olympiadparticipation': (
+        OlympiadParticipation,
+        ['student__last_name', 'student__first_name', 'student__middle_name',
+         'olympiad__name', 'olympiad__location__name', 'olympiad__stage'],
+        lambda ln, fn, mn, name, location, stage:
+            f"{full_name_str(ln, fn, mn)}, {adv_join(', ', [name, location, stage])}"
+    ),
+}
+
+PROJECTION_CHUNK_SIZE = 2000
+
+
+def fetch_projected_strings(obj_type: str, ids: Iterable[int] = None) -> list[Tuple[int, str]]:
+    (model, columns, format_) = obj_type_projection_map[obj_type]
+    qs = model.objects.all()
+    if ids is not None:
+        qs = qs.filter(pk__in=list(ids))
+    rows = qs.order_by('pk').values_list('pk', *columns).iterator(chunk_size=PROJECTION_CHUNK_SIZE)
+    return [(row[0], format_(*row[1:])) for row in rows]
+
+
+# Blocks bigger than this are not discriminative enough (e.g. the "ова" trigram
+# in Russian surnames) and would bring the quadratic behaviour back
+DEFAULT_MAX_BLOCK_SIZE = 50
+
+# How many following neighbours each string is compared with after sorting
+DEFAULT_WINDOW = 10
+
+NGRAM_SIZE = 3
+
+# Pairs are gathered and scored in batches of this size
+SCORE_BATCH_SIZE = 4096
+
+# Number of pairs sent to a worker process at once
+SCORE_CHUNK_SIZE = 50000
+
+# Slow methods (token/partial/weighted ones) first prune the pairs with this one, only
+# the best limit * RERANK_FACTOR of them are rescored with the requested method
+PREFILTER_METHOD = 'ratio'
+RERANK_FACTOR = 5
+
+# Cheap methods, fuzz.ratio's length bound (2 * shorter / total length) holds for them
+length_bounded_methods = {'ratio', 'QRatio', 'UQRatio'}
+
+# Pairs of voiced/voiceless consonants and similar sounding letters are collapsed,
+# vowels (except the first letter) and signs are dropped
+ru_phonetic_map = {
+    'б': 'п', 'в': 'ф', 'г': 'к', 'д': 'т', 'ж': 'ш', 'з': 'с', 'щ': 'ш',
+    'ё': 'е', 'й': 'и', 'ы': 'и', 'э': 'е', 'ю': 'у', 'я': 'а', 'о': 'а',
+}
+ru_vowels = set('аеиоуыэюяё')
+ru_signs = set('ъь')
+
+
+def normalize_string(s: str) -> str:
+    s = s.lower().replace('ё', 'е')
+    s = re.sub(r'[\W_]+', ' ', s)
+    return ' '.join(s.split())
+
+
+def string_ngrams(s: str, n: int = NGRAM_SIZE) -> set[str]:
+    padded = f' {s} '
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def phonetic_key(word: str) -> str:
+    if not word:
+        return ''
+
+    res = []
+    for i, c in enumerate(word):
+        if c in ru_signs:
+            continue
+        if i > 0 and c in ru_vowels:
+            continue
+        c = ru_phonetic_map.get(c, c)
+        if res and res[-1] == c:
+            continue
+        res.append(c)
+
+    return ''.join(res)
+
+
+def blocking_keys(normalized: str) -> set[str]:
+    keys = {'n:' + g for g in string_ngrams(normalized)}
+    keys |= {'p:' + phonetic_key(w) for w in normalized.split() if len(w) > 1}
+    return keys
+
+
+def sorted_neighbourhood_keys(normalized: str) -> Tuple[str, str]:
+    words = normalized.split()
+    return (
+        normalized,
+        ' '.join(sorted(phonetic_key(w) for w in words)),
+    )
+
+
+def candidate_pairs(
+        normalized: list[str],
+        max_block_size: int = DEFAULT_MAX_BLOCK_SIZE,
+        window: int = DEFAULT_WINDOW
+) -> set[Tuple[int, int]]:
+    n = len(normalized)
+    pairs: set[Tuple[int, int]] = set()
+
+    # Stage 1: objects sharing a rare n-gram or a phonetic key of a word
+    index: dict[str, list[int]] = {}
+    for i, s in enumerate(normalized):
+        for k in blocking_keys(s):
+            add_to_dict_multival(index, k, i)
+
+    for block in index.values():
+        if len(block) < 2 or len(block) > max_block_size:
+            continue
+        for a in range(len(block)):
+            for b in range(a + 1, len(block)):
+                pairs.add((block[a], block[b]))
+
+    # Stage 2: sorted neighbourhood, catches pairs that only share frequent keys
+    sn_keys = [sorted_neighbourhood_keys(s) for s in normalized]
+    for k in range(2):
+        order = sorted(range(n), key=lambda i: sn_keys[i][k])
+        for pos, i in enumerate(order):
+            for j in order[pos + 1:pos + 1 + window]:
+                pairs.add((i, j) if i < j else (j, i))
+
+    return pairs
+
+
+def all_pairs(n: int) -> Iterable[Tuple[int, int]]:
+    for i in range(n):
+        for j in range(i + 1, n):
+            yield i, j
+
+
+def length_bound(s1: str, s2: str) -> int:
+    # Upper bound of fuzz.ratio which needs no comparison at all
+    total = len(s1) + len(s2)
+    return round(200 * min(len(s1), len(s2)) / total) if total else 100
+
+
+def prefilter_string(s: str) -> str:
+    # Word order does not matter for most methods, so the prefilter compares sorted words
+    return ' '.join(sorted(normalize_string(s).split()))
+
+
+def make_scorer(method: str) -> Tuple[Callable[[str], str], Callable[[str, str], int]]:
+    # Returns (preprocess, score). The preprocessing fuzzywuzzy would otherwise repeat
+    # on every call is done once per string and the scorer is called with it disabled,
+    # the scores are the same as the ones of cmp_func_map[method]
+    if method not in cmp_func_map:
+        raise ArgumentError('Bad method')
+
+    if method in ['ratio', 'partial_ratio']:
+        return (lambda s: s), cmp_func_map[method]
+
+    force_ascii = method not in ['UQRatio', 'UWRatio']
+    func = {
+        'UQRatio': fuzz.QRatio,
+        'UWRatio': fuzz.WRatio,
+    }.get(method, cmp_func_map[method])
+
+    def preprocess(s: str) -> str:
+        return fuzz_utils.full_process(s, force_ascii=force_ascii)
+
+    def score(s1: str, s2: str) -> int:
+        return func(s1, s2, force_ascii=force_ascii, full_process=False)
+
+    return preprocess, score
+
+
+def top_pairs(
+        limit: int,
+        strings: list[str],
+        pairs: Iterable[Tuple[int, int]],
+        score: Callable[[str, str], int],
+        batch_size: int = SCORE_BATCH_SIZE,
+        bound: Callable[[str, str], int] = None
+) -> list[Tuple[int, int, int]]:
+    heap: list[Tuple[int, int, int]] = []  # min-heap of (score, -i, -j), at most `limit` long
+    if limit <= 0:
+        return heap
+
+    it = iter(pairs)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            break
+
+        if bound and len(heap) >= limit:
+            # Pairs which can not beat the current minimum are not scored
+            threshold = heap[0][0]
+            batch = [(i, j) for i, j in batch if bound(strings[i], strings[j]) >= threshold]
+
+        scores = map(score, [strings[i] for i, _ in batch], [strings[j] for _, j in batch])
+        for (i, j), s in zip(batch, scores):
+            x = (s, -i, -j)
+            if len(heap) < limit:
+                heapq.heappush(heap, x)
+            elif x > heap[0]:
+                heapq.heapreplace(heap, x)
+
+    return [(s, -i, -j) for s, i, j in sorted(heap, reverse=True)]
+
+
+def score_chunk(
+        limit: int,
+        method: str,
+        strings: dict[int, str],
+        pairs: list[Tuple[int, int]]
+) -> list[Tuple[int, int, int]]:
+    # Runs in a worker process: `strings` only holds the (preprocessed) strings the chunk needs
+    _, score = make_scorer(method)
+    bound = length_bound if method in length_bounded_methods else None
+    return top_pairs(limit, strings, pairs, score, bound=bound)
+
+
+def merge_top_pairs(limit: int, results: Iterable[list[Tuple[int, int, int]]]) -> list[Tuple[int, int, int]]:
+    return heapq.nlargest(
+        limit,
+        (x for res in results for x in res),
+        key=lambda x: (x[0], -x[1], -x[2])
+    )
+
+
+def score_pairs(
+        limit: int,
+        strings: list[str],
+        pairs: Iterable[Tuple[int, int]],
+        total: int,
+        method: str,
+        workers: int = 1,
+        progress: Callable[[int, int], None] = None
+) -> list[Tuple[int, int, int]]:
+    # `strings` must already be preprocessed for the method
+    if workers <= 1 or total <= SCORE_CHUNK_SIZE:
+        res = score_chunk(limit, method, strings, pairs)
+        if progress:
+            progress(total, total)
+        return res
+
+    done = 0
+    results = []
+    it = iter(pairs)
+    with process_pool(workers) as pool:
+        futures = {}  # future -> number of pairs in its chunk
+        while True:
+            # Keeps a bounded number of chunks in flight so the pairs are never all materialized
+            while len(futures) < workers * 2:
+                chunk = list(islice(it, SCORE_CHUNK_SIZE))
+                if not chunk:
+                    break
+                chunk_strings = {}
+                for i, j in chunk:
+                    chunk_strings[i] = strings[i]
+                    chunk_strings[j] = strings[j]
+                futures[pool.submit(score_chunk, limit, method, chunk_strings, chunk)] = len(chunk)
+
+            if not futures:
+                break
+
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for f in finished:
+                results.append(f.result())
+                done += futures.pop(f)
+                if progress:
+                    progress(done, total)
+
+    return merge_top_pairs(limit, results)
+
+
+def find_nearest_strings(
+        limit: int,
+        strings: list[str],
+        method: str = 'ratio',
+        exhaustive: bool = False,
+        workers: int = 1,
+        progress: Callable[[int, int], None] = None,
+        rerank_factor: int = RERANK_FACTOR
+) -> list[Tuple[int, int, int]]:
+    preprocess, score = make_scorer(method)
+
+    if exhaustive:
+        n = len(strings)
+        total = n * (n - 1) // 2
+        pairs = all_pairs(n)
+    else:
+        pairs = sorted(candidate_pairs([normalize_string(s) for s in strings]))
+        total = len(pairs)
+
+    if exhaustive or method in length_bounded_methods or rerank_factor <= 0:
+        processed = [preprocess(s) for s in strings]
+        return score_pairs(limit, processed, pairs, total, method, workers, progress)
+
+    # Stage 1: the cheap method picks the survivors
+    cheap = [prefilter_string(s) for s in strings]
+    survivors = score_pairs(limit * rerank_factor, cheap, pairs, total, PREFILTER_METHOD, workers, progress)
+
+    # Stage 2: the requested method reranks them
+    processed = {}
+    for _, i, j in survivors:
+        for k in (i, j):
+            if k not in processed:
+                processed[k] = preprocess(strings[k])
+    bound = length_bound if method in length_bounded_methods else None
+    return top_pairs(limit, processed, sorted((i, j) for _, i, j in survivors), score, bound=bound)
+
+
+def similarity_recall(
+        limit: int,
+        strings: list[str],
+        method: str = 'ratio',
+        rerank_factor: int = RERANK_FACTOR
+) -> dict[str, float]:
+    t0 = time.perf_counter()
+    exact = find_nearest_strings(limit, strings, method, exhaustive=True)
+    t1 = time.perf_counter()
+    blocked = find_nearest_strings(limit, strings, method, rerank_factor=rerank_factor)
+    t2 = time.perf_counter()
+
+    # Ties at the cut-off may legitimately be swapped, so compare by score too
+    exact_scores = sorted((r[0] for r in exact), reverse=True)
+    blocked_scores = sorted((r[0] for r in blocked), reverse=True)
+    score_hits = sum(1 for a, b in zip(exact_scores, blocked_scores) if b >= a)
+
+    exact_pairs = {(i, j) for _, i, j in exact}
+    blocked_pairs = {(i, j) for _, i, j in blocked}
+
+    return {
+        'objects': len(strings),
+        'exhaustive_seconds': t1 - t0,
+        'blocked_seconds': t2 - t1,
+        'pair_recall': len(exact_pairs & blocked_pairs) / len(exact) if exact else 1.0,
+        'score_recall': score_hits / len(exact) if exact else 1.0,
+    }
@@ -0,0 +1,310 @@
+# Persistent index of duplicate candidates. It is built once per object type and
+# method, afterwards only new and changed objects are compared against the stored
+# blocking keys.
+from typing import Iterable, Callable, Optional, Tuple
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.deletion import Collector
+from django.db.models import Count, Q
+
+from ..models import *
+from .similarity import obj_type_projection_map, fetch_projected_strings, find_nearest_strings, blocking_keys, \
+    normalize_string, make_scorer, DEFAULT_MAX_BLOCK_SIZE
+from .util import add_to_dict_multival, chunks
+
+BULK_BATCH_SIZE = 1000
+IN_CHUNK_SIZE = 1000
+
+
+def similarity_index_limit() -> int:
+    return getattr(settings, 'SIMILARITY_INDEX_LIMIT', 1000)
+
+
+def similarity_min_score() -> int:
+    return getattr(settings, 'SIMILARITY_MIN_SCORE', 80)
+
+
+def entry_keys(entry: SimilarityEntry) -> set[str]:
+    return {k[:255] for k in blocking_keys(normalize_string(entry.string))}
+
+
+def sync_entries(obj_type: str, ids: Iterable[int] = None) -> list[SimilarityEntry]:
+    # Brings the stored strings in line with the database, returns new and changed entries
+    if ids is None:
+        return sync_entry_chunk(obj_type, None)
+    touched = []
+    for chunk in chunks(sorted(set(ids)), IN_CHUNK_SIZE):
+        touched += sync_entry_chunk(obj_type, chunk)
+    return touched
+
+
+def sync_entry_chunk(obj_type: str, ids: Optional[list[int]]) -> list[SimilarityEntry]:
+    current = dict(fetch_projected_strings(obj_type, ids))
+
+    stored_qs = SimilarityEntry.objects.filter(obj_type=obj_type)
+    if ids is not None:
+        stored_qs = stored_qs.filter(object_id__in=ids)
+    stored = {e.object_id: e for e in stored_qs}
+
+    removed = [e.id for oid, e in stored.items() if oid not in current]
+    for chunk in chunks(removed, IN_CHUNK_SIZE):
+        SimilarityEntry.objects.filter(id__in=chunk).delete()
+
+    changed = []
+    new = []
+    for oid, s in current.items():
+        e = stored.get(oid)
+        if e is None:
+            new.append(SimilarityEntry(obj_type=obj_type, object_id=oid, string=s))
+        elif e.string != s:
+            e.string = s
+            changed.append(e)
+
+    SimilarityEntry.objects.bulk_update(changed, ['string'], batch_size=BULK_BATCH_SIZE)
+    new = SimilarityEntry.objects.bulk_create(new, batch_size=BULK_BATCH_SIZE)
+
+    for chunk in chunks([e.id for e in changed], IN_CHUNK_SIZE):
+        SimilarityKey.objects.filter(entry__in=chunk).delete()
+    SimilarityKey.objects.bulk_create(
+        [
+            SimilarityKey(obj_type=obj_type, key=k, entry_id=e.id)
+            for e in changed + new
+            for k in entry_keys(e)
+        ],
+        batch_size=BULK_BATCH_SIZE
+    )
+
+    return changed + new
+
+
+def build_similarity_index(
+        obj_type: str,
+        method: str,
+        workers: int = 1,
+        progress: Callable[[int, int], None] = None
+) -> SimilarityIndex:
+    with transaction.atomic():
+        sync_entries(obj_type)
+
+    entries = list(
+        SimilarityEntry.objects
+        .filter(obj_type=obj_type)
+        .order_by('id')
+        .values_list('id', 'string')
+    )
+    pairs = find_nearest_strings(
+        similarity_index_limit(),
+        [s for _, s in entries],
+        method,
+        workers=workers,
+        progress=progress
+    )
+
+    with transaction.atomic():
+        index, _ = SimilarityIndex.objects.update_or_create(obj_type=obj_type, method=method)
+        # Dismissed pairs are kept, so they do not come back after a rebuild
+        SimilarityCandidate.objects.filter(index=index, dismissed=False).delete()
+        SimilarityCandidate.objects.bulk_create(
+            [
+                SimilarityCandidate(index=index, entry1_id=entries[i][0], entry2_id=entries[j][0], score=score)
+                for score, i, j in pairs
+            ],
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+    return index
+
+
+def score_entries(index: SimilarityIndex, entries: list[SimilarityEntry]):
+    # Compares the given entries with everything sharing a (not too common) blocking key.
+    # The sorted neighbourhood pass of the full build is not repeated here.
+    if not entries:
+        return
+
+    keys = {e.id: entry_keys(e) for e in entries}
+    all_keys = set().union(*keys.values())
+
+    small_keys = set()
+    for chunk in chunks(sorted(all_keys), IN_CHUNK_SIZE):
+        small_keys.update(
+            SimilarityKey.objects
+            .filter(obj_type=index.obj_type, key__in=chunk)
+            .values('key')
+            .annotate(count=Count('id'))
+            .filter(count__lte=DEFAULT_MAX_BLOCK_SIZE)
+            .values_list('key', flat=True)
+        )
+
+    blocks = {}
+    for chunk in chunks(sorted(small_keys), IN_CHUNK_SIZE):
+        for k, entry_id in SimilarityKey.objects \
+                .filter(obj_type=index.obj_type, key__in=chunk) \
+                .values_list('key', 'entry_id'):
+            add_to_dict_multival(blocks, k, entry_id)
+
+    pairs = set()
+    for e in entries:
+        for k in keys[e.id] & small_keys:
+            for other in blocks[k]:
+                if other != e.id:
+                    pairs.add((min(e.id, other), max(e.id, other)))
+
+    needed = {i for p in pairs for i in p}
+    preprocess, score = make_scorer(index.method)
+    strings = {}
+    for chunk in chunks(sorted(needed), IN_CHUNK_SIZE):
+        for i, s in SimilarityEntry.objects.filter(id__in=chunk).values_list('id', 'string'):
+            strings[i] = preprocess(s)
+
+    min_score = similarity_min_score()
+    candidates = []
+    for e1, e2 in sorted(pairs):
+        s = score(strings[e1], strings[e2])
+        if s >= min_score:
+            candidates.append(SimilarityCandidate(index=index, entry1_id=e1, entry2_id=e2, score=s))
+
+    for touched in chunks([e.id for e in entries], IN_CHUNK_SIZE):
+        SimilarityCandidate.objects \
+            .filter(index=index, dismissed=False) \
+            .filter(Q(entry1_id__in=touched) | Q(entry2_id__in=touched)) \
+            .delete()
+    SimilarityCandidate.objects.bulk_create(candidates, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+
+
+def update_similarity_index(obj_type: str, ids: Iterable[int] = None):
+    indexes = list(SimilarityIndex.objects.filter(obj_type=obj_type))
+    if not indexes:
+        return  # Not built yet, the first search builds it
+
+    with transaction.atomic():
+        touched = sync_entries(obj_type, ids)
+        for index in indexes:
+            score_entries(index, touched)
+            index.save()
+
+
+def update_similarity_indexes(changed: dict[type, Iterable[int]] = None):
+    # The entries of the changed objects (by model) and of the objects embedding them,
+    # every entry when not given
+    if changed is None:
+        for obj_type in SimilarityIndex.objects.values_list('obj_type', flat=True).distinct():
+            update_similarity_index(obj_type)
+        return
+    for model, ids in changed.items():
+        if ids:
+            update_similarity_index_for_model(model, ids)
+
+
+def similarity_obj_types_for_model(model: type) -> list[str]:
+    # Multi-table inheritance shares primary keys, so e.g. a course is also an activity
+    return [
+        t
+        for t, (m, _, _) in obj_type_projection_map.items()
+        if issubclass(model, m) or issubclass(m, model)
+    ]
+
+
+def related(m1: type, m2: type) -> bool:
+    return issubclass(m1, m2) or issubclass(m2, m1)
+
+
+def projection_relation_paths(obj_type: str) -> list[Tuple[str, type]]:
+    # Relations the strings of an object type are built through, e.g. course__location
+    model, columns, _ = obj_type_projection_map[obj_type]
+    paths = {}
+    for column in columns:
+        parts = column.split('__')
+        m = model
+        for i in range(len(parts) - 1):
+            m = m._meta.get_field(parts[i]).related_model
+            paths['__'.join(parts[:i + 1])] = m
+    return list(paths.items())
+
+
+def similarity_dependent_obj_types(model: type) -> dict[str, list[str]]:
+    # Object types whose strings contain the strings of the model's objects (e.g.
+    # participations contain the names of the students), with the relation paths
+    res = {}
+    for obj_type in obj_type_projection_map:
+        paths = [p for p, m in projection_relation_paths(obj_type) if related(model, m)]
+        if paths:
+            res[obj_type] = paths
+    return res
+
+
+def similarity_dependents(model: type, ids: Iterable[int]) -> dict[str, set[int]]:
+    # Ids of the indexed objects whose strings embed the given objects. For deletions this
+    # is to be called before the objects (and their cascade) are deleted.
+    ids = sorted(set(ids))
+    dependent = similarity_dependent_obj_types(model)
+    indexed = SimilarityIndex.objects.filter(obj_type__in=list(dependent)).values_list('obj_type', flat=True)
+
+    res = {}
+    for obj_type in set(indexed):
+        target = obj_type_projection_map[obj_type][0]
+        res[obj_type] = set()
+        for chunk in chunks(ids, IN_CHUNK_SIZE):
+            q = Q()
+            for path in dependent[obj_type]:
+                q |= Q(**{f'{path}__in': chunk})
+            res[obj_type].update(target.objects.filter(q).values_list('pk', flat=True))
+    return res
+
+
+def similarity_dependents_of_deletion(queryset: models.QuerySet) -> dict[str, set[int]]:
+    # Before a deletion: the dependents, and the objects the cascade deletes along
+    # (e.g. the participations of a course, including their Participation parents)
+    ids = list(queryset.values_list('pk', flat=True))
+    res = similarity_dependents(queryset.model, ids)
+
+    collector = Collector(using=queryset.db)
+    collector.collect(queryset)
+    deleted: dict[type, set[int]] = {}
+    for m, objs in collector.data.items():
+        deleted.setdefault(m, set()).update(o.pk for o in objs)
+    for qs in collector.fast_deletes:
+        deleted.setdefault(qs.model, set()).update(qs.values_list('pk', flat=True))
+
+    for m, deleted_ids in deleted.items():
+        for obj_type in similarity_obj_types_for_model(m):
+            res.setdefault(obj_type, set()).update(deleted_ids)
+    return res
+
+
+def similarity_index_exists(model: type) -> bool:
+    obj_types = similarity_obj_types_for_model(model) + list(similarity_dependent_obj_types(model))
+    return SimilarityIndex.objects.filter(obj_type__in=obj_types).exists()
+
+
+def update_similarity_index_for_model(model: type, ids: Iterable[int], dependents: dict[str, set[int]] = None):
+    # The entries of the objects themselves and of the objects whose strings embed them
+    ids = list(ids)
+    if dependents is None:
+        dependents = similarity_dependents(model, ids)
+    for obj_type in similarity_obj_types_for_model(model):
+        update_similarity_index(obj_type, ids)
+    for obj_type, dependent_ids in dependents.items():
+        if dependent_ids:
+            update_similarity_index(obj_type, dependent_ids)
+
+
+def get_similar_candidates(
+        obj_type: str,
+        method: str,
+        limit: int,
+        rebuild: bool = False,
+        workers: int = 1,
+        progress: Callable[[int, int], None] = None
+) -> list[SimilarityCandidate]:
+    index: Optional[SimilarityIndex] = SimilarityIndex.objects.filter(obj_type=obj_type, method=method).first()
+    if index is None or rebuild:
+        index = build_similarity_index(obj_type, method, workers, progress)
+
+    return list(
+        SimilarityCandidate.objects
+        .filter(index=index, dismissed=False)
+        .select_related('entry1', 'entry2')
+        .order_by('-score', 'id')[:limit]
+    )
@@ -1,7 +1,11 @@
 
 # Here go some useful utility functions
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from typing import Iterable, Any, Dict
 
+import django
+
 
 def add_to_dict_multival(d: dict[Any, list[Any]], k: Any, v: Any):
     if k in d:
@@ -22,4 +26,19 @@ def group_by_type(it: Iterable[Any]) -> dict[type, list[Any]]:
     for x in it:
         add_to_dict_multival(res, type(x), x)
     
-    return res
\ No newline at end of file
+    return res
+
+
+def chunks(it: Iterable[Any], size: int) -> Iterable[list[Any]]:
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_pool(max_workers: int = None) -> ProcessPoolExecutor:
+    # Workers import app modules (and so the models), which needs the app registry
+    # ready when processes are spawned rather than forked
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=django.setup)
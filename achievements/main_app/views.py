@@ -3,27 +3,39 @@ import json
 import logging
 import os
 import tempfile
-from ctypes import ArgumentError
 from io import FileIO, BytesIO
 from typing import Callable
 
 from django.conf import settings
 from django.core import serializers
 from django.core.files.uploadedfile import UploadedFile
+from django.core.paginator import Paginator
 from django.db import transaction
-from django.db.models import Model, Count, Sum, Max, Q
+from django.db.models import Model, Count, Sum, Max, Q, OuterRef, Subquery
+from django.db.models.functions import ExtractYear
 from django.forms import Form
 from django.http import HttpResponse, FileResponse, HttpResponseBadRequest, HttpRequest, HttpResponseForbidden, \
-    HttpResponseServerError
+    HttpResponseServerError, JsonResponse
 from django.shortcuts import render
 from django.utils.html import escape
-from fuzzywuzzy import fuzz
+from django.views.decorators.csrf import ensure_csrf_cookie
 
+from achievements.middlewares.LoginRequiredMiddleware import staff_required
 from .forms import CourseEdit
 from .reports.student_report import generate_document_for_many_students, document_to_odt_data, \
     generate_document_for_student, odt_data_to_pdf_reader, generate_document_for_summer_student
+from .util.bulk_edit import bulk_edit, bulk_edit_fields, BulkEditException
+from .util.bulk_import import BulkImporter, file_digest, imported_file_digests, record_imported_files
+from .util.dashboard import get_dashboard_stats, invalidate_dashboard_stats
+from .util.dedupe import dedupe_educations
+from .util.merge import merge_objects, MergeException
+from .util.names import known_surnames, gender_by_name
 from .util.data_import import *
-from .util.util import group_by_type, add_to_dict_multival_set
+from .util.profile import load_student_profile
+from .util.progress import set_task_progress, get_task_progress
+from .util.similarity import obj_type_projection_map, cmp_func_map
+from .util.similarity_index import get_similar_candidates
+from .util.util import add_to_dict_multival
 import zipfile
 
 
@@ -40,13 +52,7 @@ def p404(request, exception):
 
 
 def index(request):
-    stats = {
-        'students': Education.objects.values('student__id').distinct().count(),
-        'courses': Course.objects.values('id').distinct().count(),
-        'projects': Project.objects.values('id').distinct().count(),
-        'olympiads': Olympiad.objects.values('id').distinct().count(),
-        'seminars': Seminar.objects.values('id').distinct().count(),
-    }
+    stats = get_dashboard_stats()
     return render(request, 'index.html', {'stats': stats})
 
 
@@ -75,11 +81,36 @@ def students(request):
     )
 
 
+COURSES_PAGE_SIZE = 50
+
+
 def courses(request):
-    courses_ = Course.objects.all()
-    for c in courses_:
-        c.default_departments_ = c.default_departments.get_queryset()
-    return render(request, 'courses.html', {'courses': courses_})
+    courses_ = Course.objects \
+        .select_related('location', 'subject') \
+        .prefetch_related('default_departments') \
+        .order_by('id')
+
+    subject_id = request.GET.get('subject', '')
+    location_id = request.GET.get('location', '')
+    if subject_id.isdigit():
+        courses_ = courses_.filter(subject__id=int(subject_id))
+    if location_id.isdigit():
+        courses_ = courses_.filter(location__id=int(location_id))
+
+    page = Paginator(courses_, COURSES_PAGE_SIZE).get_page(request.GET.get('page'))
+
+    return render(
+        request,
+        'courses.html',
+        {
+            'courses': page,
+            'page': page,
+            'subjects': Subject.objects.filter(course__isnull=False).distinct().order_by('name'),
+            'locations': Location.objects.filter(activity__course__isnull=False).distinct().order_by('name'),
+            'selected_subject': subject_id,
+            'selected_location': location_id,
+        }
+    )
 
 
 def courses_edit(request, id):
@@ -94,68 +125,49 @@ def courses_edit(request, id):
         HttpResponse()
 
 
-def import_combined_data(data, strict=True):
-    results = []
-
-    import_func_map = {
-        'education': import_education,
-        'course': import_course,
-        'seminar': import_seminar,
-        'project': import_project,
-        'olympiad': import_olympiad,
-    }
-
-    for k in data:
-        for rec in data[k]:
-            try:
-                func = import_func_map[k]
-                res = func(rec, strict=strict)
-                if res:
-                    results += res
-            except Exception as e:
-                if strict:
-                    raise e
-                else:
-                    pass
+def import_records(records: Iterable[Tuple[str, record]], strict=True, force=False):
+    # The importer writes in batches as the records come, all of them or none are imported
+    with transaction.atomic():
+        importer = BulkImporter(strict=strict, force=force)
+        for kind, rec in records:
+            importer.add(kind, rec)
 
-    return results
+        return importer.run()
 
 
 def import_(request: HttpRequest):
     if request.method == 'POST':
         try:
             files: Iterable[UploadedFile] = request.FILES.getlist('data_files')
-            use_old_format = request.POST.get('use_old_format')
-            results_ungrouped = []
+            use_old_format = bool(request.POST.get('use_old_format'))
+            force = bool(request.POST.get('force'))
+
+            uploads = []
+            skipped_files = []
+            for file in files:
+                content = file.read()
+                uploads.append((file.name, content, file_digest(content, use_old_format)))
+            if not force:
+                # Files imported before without changes are not even parsed
+                known = imported_file_digests(digest for _, _, digest in uploads)
+                skipped_files = [name for name, _, digest in uploads if digest in known]
+                uploads = [u for u in uploads if u[2] not in known]
 
             try:
-                with transaction.atomic():
-                    combined_data = {}
-                    parsed_data = {}
-
-                    for file in files:
-                        doc = opendocument.load(file.file)
-                        if use_old_format:
-                            parsed_data = doc_parse_old_and_ugly_format(
-                                doc,
-                                filename=file.name
-                            )
-                        else:
-                            parsed_data = doc_parse(doc)
-
-                        for k in parsed_data:
-                            if k in combined_data:
-                                combined_data[k] += parsed_data[k]
-                            else:
-                                combined_data[k] = parsed_data[k]
-
-                    combined_data['education'] = stitch_educations(combined_data['education'])
-                    combined_data = sanitize_dict_vals(combined_data)
-                    results_ungrouped = import_combined_data(combined_data, strict=False)
+                # The next files are parsed in the workers while the rows of the previous ones are written
+                parsed = parse_files(
+                    [(name, content) for name, content, _ in uploads],
+                    use_old_format=use_old_format,
+                    workers=settings.IMPORT_WORKERS,
+                )
+                result = import_records(route_records(parsed), strict=False, force=force)
             except DataFormatException as e:
                 return render(request, 'import_finished.html', {'error': e})
 
-            grouped = group_by_type(results_ungrouped)
+            record_imported_files((name, digest) for name, _, digest in uploads)
+
+            invalidate_dashboard_stats()
+
             results = []
             type_mappings = {
                 User: {'cat': 'Пользователи'},
@@ -163,7 +175,6 @@ def import_(request: HttpRequest):
                 Education: {'cat': 'Обучения'},
                 Subject: {'cat': 'Предметы'},
                 Location: {'cat': 'Места'},
-                Activity: {'cat': 'Деятельности'},
                 Course: {'cat': 'Курсы'},
                 Seminar: {'cat': 'Семинары'},
                 Project: {'cat': 'Проекты'},
@@ -173,14 +184,23 @@ def import_(request: HttpRequest):
                 ProjectParticipation: {'cat': 'Участия в проектах'},
                 OlympiadParticipation: {'cat': 'Участия в олимпиадах'},
             }
-            for t in list(grouped.keys()):
-                unique = list(set(map(lambda x: str(x), grouped[t])))
-                unique.sort()
+            for t in result.models():
                 mapping = dict(type_mappings[t])
-                mapping['objects'] = unique
+                mapping['created'] = result.created[t]
+                mapping['updated'] = result.updated[t]
+                mapping['existing'] = result.existing[t]
+                mapping['skipped'] = result.skipped[t]
+                mapping['objects'] = result.samples.get(t, [])
+                total = result.created[t] + result.updated[t] + result.existing[t]
+                mapping['more'] = total - len(mapping['objects'])
                 results.append(mapping)
 
-            return render(request, 'import_finished.html', {'results': results})
+            return render(request, 'import_finished.html', {
+                'results': results,
+                'skipped_files': skipped_files,
+                'skipped_rows': result.skipped_rows,
+                'invalid_rows': result.invalid_rows,
+            })
 
         except Exception as e:
             raise e
@@ -188,83 +208,51 @@ def import_(request: HttpRequest):
         return render(request, 'import.html')
 
 
+@ensure_csrf_cookie
+@staff_required
 def tasks(request):
     return render(request, 'tasks/index.html')
 
 
-def check_names(request):
-    db_ru_names = os.path.join(settings.BASE_DIR, 'main_app/static/russian_names.json')
-    db_ru_surnames = os.path.join(settings.BASE_DIR, 'main_app/static/russian_surnames.json')
-    db_foreign_names = os.path.join(settings.BASE_DIR, 'main_app/static/foreign_names.json')
+CHECK_NAMES_PAGE_SIZE = 5000
 
-    name_gender = {}
-    surnames = set()
+
+@staff_required
+def check_names(request):
+    surnames = known_surnames()
 
     added_gender: list[Tuple[int, str, str, str]] = []
     wrong_names: list[Tuple[int, str]] = []
     wrong_surnames: list[Tuple[int, str]] = []
 
-    for ndb in [db_ru_names, db_foreign_names]:
-        f = open(ndb, 'r', encoding='utf8')
-        js = json.load(f)
-        for o in js:
-            if 'Sex' in o:
-                gender = 'M' if o['Sex'] == 'М' else 'F'  # Those are different 'M' letters (en and ru)
-            elif 'gender' in o:
-                gender = 'M' if o['gender'] == 'Male' else 'F'
-            else:
-                continue
-
-            if 'Name' in o:
-                name = str(o['Name'])
-            elif 'name' in o:
-                name = str(o['name'])
-            else:
-                continue
-
-            name_gender[name.capitalize()] = gender
-
-    for sdb in [db_ru_surnames]:
-        f = open(sdb, 'r', encoding='utf8')
-        js = json.load(f)
-
-        for o in js:
-            if 'Surname' in o:
-                surnames.add( str(o['Surname']).capitalize() )
-            else:
-                continue
-
-    all_names = User.objects\
-        .all()\
-        .values('id', 'first_name', 'last_name', 'gender')
-
-    for n in all_names:
-        (id, first_name, last_name, gender) = (
-            n['id'], n['first_name'], n['last_name'], n['gender']
-        )
-        new_gender = name_gender[first_name] if first_name in name_gender else None
-        print(id, first_name, last_name, gender, new_gender)
+    all_names = User.objects \
+        .order_by('id') \
+        .values_list('id', 'first_name', 'last_name', 'gender')
+    page = Paginator(all_names, CHECK_NAMES_PAGE_SIZE).get_page(request.GET.get('page'))
+
+    fixed_users = []
+    for (id, first_name, last_name, gender) in page:
+        new_gender = gender_by_name(first_name)
         if not gender and new_gender:
             added_gender.append((id, first_name, last_name, new_gender))
-            u = User.objects\
-                .get(id=id)
+            fixed_users.append(User(id=id, gender=new_gender))
 
-            u.gender = new_gender
-            u.save()
-
-        if first_name not in name_gender.keys():
+        if new_gender is None:
             wrong_names.append((id, first_name))
 
         if last_name not in surnames:
             wrong_surnames.append((id, last_name))
 
+    User.objects.bulk_update(fixed_users, ['gender'], batch_size=1000)
+
     return render(
         request,
         'tasks/check_names.html',
         {
             'added_gender': added_gender,
             'wrong_names': wrong_names,
-            'wrong_surnames': wrong_surnames
+            'wrong_surnames': wrong_surnames,
+            'page': page,
         }
     )
 
@@ -277,26 +265,31 @@ def print_index(request):
 
 
 def print_everything(request):
-    dep_years_ = {}
-
-    for edu in Education.objects.all():
-        add_to_dict_multival_set(
-            dep_years_,
-            edu.department,
-            edu.finish_date.year
-        )
+    last_generated = PrintArchive.objects \
+        .filter(department__id=OuterRef('department_id'), year=OuterRef('year')) \
+        .order_by('-generated') \
+        .values('generated')[:1]
+
+    cells = Education.objects \
+        .values('department_id', 'department__name', year=ExtractYear('finish_date')) \
+        .annotate(
+            students=Count('student_id', distinct=True),
+            last_generated=Subquery(last_generated)
+        ) \
+        .order_by('department__name', 'year')
 
     dep_years = {}
-    for d in dep_years_:
-        s = list(dep_years_[d])
-        s.sort()
-        dep_years[d] = s
+    for c in cells:
+        add_to_dict_multival(dep_years, (c['department_id'], c['department__name']), c)
 
     return render(
         request,
         'print/everything.html',
         {
-            'dep_years': dep_years
+            'dep_years': [
+                {'id': dep_id, 'name': dep_name, 'years': years}
+                for (dep_id, dep_name), years in dep_years.items()
+            ]
         }
     )
 
@@ -438,6 +431,13 @@ def print_dep_year(request, dep, year, format_):
     log.info('Done creating the archive: length = %d', zip_buff.tell())
     zip_buff.seek(0)
 
+    PrintArchive.objects.update_or_create(
+        department_id=dep,
+        year=year,
+        format=format_,
+        defaults={'students_count': len(student_ids)}
+    )
+
     response = FileResponse(
         zip_buff,
         content_type='application/zip',
@@ -447,40 +447,11 @@ def print_dep_year(request, dep, year, format_):
 
 
 def student_profile(request, id):
-    user = User.objects.get(id=id)
-    if not user:
+    profile = load_student_profile(id)
+    if not profile:
         return render(request, "errors/404.html", {})
-    else:
-        user = user
 
-    if user.gender == 'M':
-        user.gender_print = 'Мужской'
-    elif user.gender == 'F':
-        user.gender_print = 'Женский'
-    else:
-        user.gender_print = 'Не указан'
-
-    edu = Education.objects.filter(student__id=id)
-    cp = CourseParticipation.objects.filter(student__id=id, is_exam=False)
-    ex = CourseParticipation.objects.filter(student__id=id, is_exam=True)
-    sp = SeminarParticipation.objects.filter(student__id=id)
-    pp = ProjectParticipation.objects.filter(student__id=id)
-    op = OlympiadParticipation.objects.filter(student__id=id)
-    summer_dates = CourseParticipation.objects\
-        .filter(student__id=id, course__location__name="Летняя школа")\
-        .values_list('started', flat=True)\
-        .distinct()
-    return render(request, 'student_profile.html', {
-        'id': id,
-        'user': user,
-        'educations': edu,
-        'course_participations': cp,
-        'exam_participations': ex,
-        'seminar_participations': sp,
-        'project_participations': pp,
-        'olympiad_participations': op,
-        'summer_dates': summer_dates
-    })
+    return render(request, 'student_profile.html', profile)
 
 
 def student_report(request, sid, format_):
@@ -552,171 +523,129 @@ def print_student_summer(request, sid, start_timestamp, format_):
     return response
 
 
+@staff_required
 def dedupe_edu(request):
-    def to_seconds(date):
-        import time
-        return time.mktime(date.timetuple())
+    dry_run = bool(request.GET.get('dry_run'))
 
     try:
-        edus = Education.objects.all()
-        edus_group_by_student = {}
-        for e in edus:
-            add_to_dict_multival(edus_group_by_student, e.student.id, e)
-
-        cnt_dupes = 0
-
-        for sid in edus_group_by_student:
-            stud_edus: list[Education] = list(edus_group_by_student[sid])
-            if not stud_edus:
-                continue
+        res = dedupe_educations(dry_run)
 
-            stud_edus.sort(
-                key=lambda e: to_seconds(e.start_date)
+        if dry_run:
+            return HttpResponse(
+                f"Будет удалено дублей: {res['deleted']}, изменено записей: {res['updated']}".encode()
             )
-
-            head = stud_edus.pop(0)
-
-            for edu in stud_edus:
-                if head.department == edu.department:
-                    head.start_date = min(head.start_date, edu.start_date)
-                    head.finish_date = max(head.finish_date, edu.finish_date)
-                    head.save()
-                    edu.delete()
-                    cnt_dupes += 1
-                else:
-                    head = edu
-
-        return HttpResponse(f"Дедупликация успешно завершена. Удалено дублей: {cnt_dupes}".encode())
+        return HttpResponse(
+            f"Дедупликация успешно завершена. Удалено дублей: {res['deleted']}, изменено записей: {res['updated']}"
+            .encode()
+        )
     except Exception as e:
         return HttpResponseServerError(
             f"Error occured: {type(e).__name__}: {e}".encode()
         )
 
 
-def bulk_edit():
-    pass
-
-
+@staff_required
 def find_similar_objects(request, obj_type: str, method: str, limit: int):
-    obj_type_class_map: dict[str, type] = {
-        'user': User,
-        'location': Location,
-        'department': Department,
-        'education': Education,
-        'subject': Subject,
-        'activity': Activity,
-        'course': Course,
-        'seminar': Seminar,
-        'project': Project,
-        'olympiad': Olympiad,
-        'award': Award,
-        'participation': Participation,
-        'courseparticipation': CourseParticipation,
-        'seminarparticipation': SeminarParticipation,
-        'projectparticipation': ProjectParticipation,
-        'olympiadparticipation': OlympiadParticipation
-    }
-    obj_type_str_map: dict[str, Callable[[Model], str]] = {
-        'user': User.full_name,
-        'location': Location.__str__,
-        'department': Department.__str__,
-        'education': Education.__str__,
-        'subject': Subject.__str__,
-        'activity': Activity.__str__,
-        'course': Course.__str__,
-        'seminar': Seminar.__str__,
-        'project': Project.__str__,
-        'olympiad': Olympiad.__str__,
-        'award': Award.__str__,
-        'participation': Participation.__str__,
-        'courseparticipation': CourseParticipation.__str__,
-        'seminarparticipation': SeminarParticipation.__str__,
-        'projectparticipation': ProjectParticipation.__str__,
-        'olympiadparticipation': OlympiadParticipation.__str__
-    }
-
-    if obj_type not in obj_type_str_map or obj_type not in obj_type_class_map:
+    if obj_type not in obj_type_projection_map:
         return HttpResponseBadRequest(b'Bad object type')
+    if method not in cmp_func_map:
+        return HttpResponseBadRequest(b'Bad method')
+
+    task_id = request.GET.get('task')
+    progress = (lambda done, total: set_task_progress(task_id, done, total)) if task_id else None
+
+    candidates = get_similar_candidates(
+        obj_type,
+        method,
+        limit,
+        rebuild=bool(request.GET.get('rebuild')),
+        workers=settings.SIMILARITY_WORKERS,
+        progress=progress
+    )
 
-    obj_class = obj_type_class_map[obj_type]
-    objects: list[User] = list(obj_class.objects.all())
+    results_objs = list(map(
+        lambda c: {
+            'id': c.id,
+            'ratio': c.score,
+            'object1_name': c.entry1.string,
+            'object2_name': c.entry2.string,
+            'object1_id': c.entry1.object_id,
+            'object2_id': c.entry2.object_id
+        },
+        candidates
+    ))
 
-    f_str = obj_type_str_map[obj_type]
-    results = find_nearest_objects(limit, objects, str_func=f_str)
+    return render(request, 'tasks/similar_objects.html', {'results': results_objs, 'obj_type': obj_type})
 
-    results_objs = map(
-        lambda t: {
-            'ratio': t[0],
-            'object1_name': f_str(t[1]),
-            'object2_name': f_str(t[2]),
-            'object1_id': t[1].id,
-            'object2_id': t[2].id
-        },
-        results
-    )
 
-    return render(request, 'tasks/similar_objects.html', {'results': results_objs})
-
-
-def find_nearest_objects(
-        limit: int,
-        objects: list[models.Model],
-        str_func: Callable[[models.Model], str] = str,
-        method: str = 'ratio'
-) -> list[Tuple[int, models.Model, models.Model]]:
-    l = len(objects)
-    result: list[Tuple[int, models.Model, models.Model]] = []  # (ratio, object1, object2)
-
-    cmp_func_map: dict[str, Callable[[str, str], int]] = {
-        'ratio':                    fuzz.ratio,
-        'partial_ratio':            fuzz.partial_ratio,
-        'UQRatio':                  fuzz.UQRatio,
-        'QRatio':                   fuzz.QRatio,
-        'partial_token_set_ratio':  fuzz.partial_token_set_ratio,
-        'partial_token_sort_ratio': fuzz.partial_token_sort_ratio,
-        'token_set_ratio':          fuzz.token_set_ratio,
-        'token_sort_ratio':         fuzz.token_sort_ratio,
-        'UWRatio':                  fuzz.UWRatio,
-        'WRatio':                   fuzz.WRatio,
-    }
+@staff_required
+def dismiss_similar_objects(request, candidate_id: int):
+    if request.method != 'POST':
+        return HttpResponseBadRequest()
 
-    if method not in cmp_func_map:
-        raise ArgumentError('Bad method')
+    SimilarityCandidate.objects.filter(id=candidate_id).update(dismissed=True)
+    return HttpResponse()
 
-    cmp_func = cmp_func_map[method]
 
-    for obj_ix1 in range(l):
-        for obj_ix2 in range(obj_ix1 + 1, l):
-            ratio = cmp_func(
-                str_func(objects[obj_ix1]),
-                str_func(objects[obj_ix2])
-            )
-            x = (ratio, objects[obj_ix1], objects[obj_ix2])
-
-            if len(result) == 0:
-                result.append(x)
-                continue
-            if len(result) > limit and result[-1][0] >= ratio:
-                continue
-            for i, (ratio_, object1, object2) in enumerate(result):
-                if ratio > ratio_:
-                    result.insert(i, x)
-                    if len(result) > limit:
-                        result.pop()
-                    break
-    return result
+@staff_required
+def task_progress(request, task_id: str):
+    return JsonResponse(get_task_progress(task_id) or {})
 
 
+@staff_required
 def edit_merge(request: HttpRequest):
-    if not request.POST['object_type'] or not request.POST['object_ids']:
+    if request.method != 'POST' \
+            or not request.POST.get('object_type') \
+            or not request.POST.get('survivor_id', '').isdigit() \
+            or not request.POST.get('object_ids'):
         return HttpResponseBadRequest()
-    else:
-        Form
-        pass
 
+    try:
+        object_ids = [int(x) for x in request.POST['object_ids'].split(',')]
+    except ValueError:
+        return HttpResponseBadRequest(b'Bad object ids')
+
+    try:
+        res = merge_objects(request.POST['object_type'], int(request.POST['survivor_id']), object_ids)
+    except MergeException as e:
+        return HttpResponseBadRequest(str(e).encode())
+
+    return JsonResponse(res)
 
+
+@staff_required
 def edit_bulk(request: HttpRequest):
-    return None
+    obj_type = request.POST.get('object_type') or request.GET.get('object_type') or 'courseparticipation'
+    if obj_type not in obj_type_projection_map:
+        return HttpResponseBadRequest(b'Bad object type')
+
+    if request.method == 'GET':
+        model = obj_type_projection_map[obj_type][0]
+        return render(
+            request,
+            'bulk_edit.html',
+            {
+                'mode': 'bulk_edit',
+                'object_type': obj_type,
+                'object_types': list(obj_type_projection_map),
+                'record_type': model._meta.verbose_name,
+                'fields': bulk_edit_fields(model),
+            }
+        )
+
+    try:
+        filter_ = json.loads(request.POST.get('filter') or '{}')
+        values = json.loads(request.POST.get('values') or '{}')
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest(b'Bad JSON')
+
+    preview = bool(request.POST.get('preview'))
+    try:
+        count = bulk_edit(obj_type, filter_, values, preview)
+    except BulkEditException as e:
+        return HttpResponseBadRequest(str(e).encode())
+
+    return JsonResponse({'count': count, 'preview': preview})
 
 
 def stats(request: HttpRequest):
@@ -7,5 +7,6 @@ python manage.py flush --noinput
 python manage.py makemigrations --noinput
 python manage.py makemigrations main_app --noinput
 python manage.py migrate --noinput
+python manage.py createcachetable
 
 echo from main_app.models import User; User.objects.create_superuser('admin', 'myemail@example.com', 'admin') | python manage.py shell
\ No newline at end of file
@@ -5,4 +5,5 @@ script_path=$(dirname $(readlink -f $0))
 cd "$script_path/achievements"
 
 python manage.py migrate
+python manage.py createcachetable
 python manage.py runserver 0.0.0.0:8000 --insecure